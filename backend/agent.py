@@ -1,8 +1,23 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
+from geocode import Geocoder
+from http_client import Upstreams
+from landmarks import LandmarkCollector, top_landmarks
+from language import detect_language
+from metrics import record_usage, span
+from models import CityWalkResponse, Location
+from pipeline import TaskGraph
+from poi_cache import TileCache
+from poi_index import POIIndex
+from prompts import guide_context, guide_messages
+from response_cache import ResponseCache, normalize_query
+from routing import order_stops
+from singleflight import SingleFlight
+from streaming import ResponseStreamParser
+import tracing
+from wiki_context import WikipediaContext
+import asyncio
 import json
 import pydantic
-import requests
-import time
 import os
 
 class Model:
@@ -10,41 +25,63 @@ class Model:
         self.model = model
         self.baseUrl = baseUrl
         self.apiKey = apiKey
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             base_url=baseUrl,
             api_key=apiKey
         )
 
-    def chat_completion(self, messages, response_format=None, temperature=1, max_tokens=4000, top_p=1):
-        return self.client.beta.chat.completions.parse(
+    async def chat_completion(self, messages, response_format=None, temperature=1, max_tokens=4000, top_p=1,
+                              stage="completion"):
+        with span(stage):
+            completion = await self.client.beta.chat.completions.parse(
+                model=self.model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                messages=messages,
+                response_format=response_format
+            )
+        record_usage(stage, completion)
+        return completion
+
+    async def warm(self):
+        """Open a pooled connection to the LLM gateway before the first completion needs it."""
+        try:
+            await self.client.with_options(max_retries=0, timeout=5).models.list()
+        except Exception as e:
+            # 网关不一定支持 /models，连接已经建立就够了
+            tracing.log("warning", stage="warm.llm", error=str(e) or type(e).__name__)
+
+    def stream_completion(self, messages, response_format=None, temperature=1, max_tokens=4000, top_p=1):
+        # used as `async with model.stream_completion(...) as stream`
+        return self.client.beta.chat.completions.stream(
             model=self.model,
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
             messages=messages,
-            response_format=response_format
+            response_format=response_format,
+            # the last chunk then carries the token usage
+            stream_options={"include_usage": True}
         )
 
 
-class Location(pydantic.BaseModel):
-    latitude: str
-    longitude: str
-    displayName: str
-    rating: str
-
-
 class DisplayNames(pydantic.BaseModel):
     text: str
     languageCode: str
 
 
-class CityWalkResponse(pydantic.BaseModel):
-    locations: list[Location]
+class GuideResponse(pydantic.BaseModel):
+    # what the LLM writes: locations are names only, their coordinates come from AMap.
+    # speech comes first so a streamed completion can be spoken before the locations are done
     speech: str
+    locations: list[str]
 
 
-class InformationSeeking(pydantic.BaseModel):
-    prediction: bool
+class QueryAnalysis(pydantic.BaseModel):
+    language: str
+    translated_query: str
+    information_seeking: bool
     location: str
 
 
@@ -110,218 +147,72 @@ class Preferences(pydantic.BaseModel):
     visited: list[str]
 
 
-class Language(pydantic.BaseModel):
-    language: str
-
-
-class Translation(pydantic.BaseModel):
-    translated_text: str
+NEARBY_RADIUS = 5000
+NEARBY_TYPES = "110000"
+NEARBY_PAGE_SIZE = 20
 
 
 class CityWalkAgent:
-    def __init__(self):
-        self.memory = {}
-        self.language = "English"
-        self.conversation = {}
+    def __init__(self, poi_index=None):
+        # all external I/O goes through these pooled clients
+        self.http = Upstreams.from_env()
+        self.poi_cache = TileCache.from_env()
+        self.landmarks = LandmarkCollector.from_env(
+            self.http.amap, self.poi_cache, radius=NEARBY_RADIUS, types=NEARBY_TYPES, k=NEARBY_PAGE_SIZE
+        )
+        # the service loads the index in its own startup step and passes it in, see main.warm_up
+        self.poi_index = poi_index if poi_index is not None else POIIndex.from_env()
+        self.poi_index_min_results = int(os.getenv("POI_INDEX_MIN_RESULTS", 10))
+        self.wikipedia = WikipediaContext.from_env(self.http.wikipedia)
+        self.geocoder = Geocoder.from_env(self.http.amap)
+        self.responses = ResponseCache.from_env()
+        # identical upstream calls from visitors standing in the same spot
+        self.flights = SingleFlight()
+        self.history_tokens = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+        self.classifier_history_tokens = int(os.getenv("CLASSIFIER_HISTORY_TOKENS", 800))
         self.model = Model(
-            model="gpt-4o-mini",
-            baseUrl="https://aigc.sankuai.com/v1/openai/native",
+            model=os.getenv("OPENAI_MODEL") or "gpt-4o-mini",
+            baseUrl=os.getenv("OPENAI_BASE_URL") or "https://aigc.sankuai.com/v1/openai/native",
             apiKey=os.getenv("OPENAI_API_KEY")
         )
-        self.system_prompt = {
-            "role": "system",
-            "content": """
-            You are Hugo, a multilingual professional Personal Tour Guide. 
-            You are taking a visitor on a city walk.
-            Your speech response should ALWAYS be in the language of {language}. 
-            You will be provided with a list of information about the city and the visitor's interests.
-            You will need to use this information to answer the visitor's questions and provide them with a memorable experience.
-            You should always ask some clarifying questions to understand the visitor's interests and preferences.
-            Whenever you provide a recommendation, you must provide a list of locations and a speech response, locations shouldn't be too far from the starting point.
-            Try your best to provide the list of locations that provide the best route for the visitor to take, so they don't have to backtrack.
-            Since the visitor will be able to visualize on locations you are recommending, keep the your speech short, informative, and engaging; but the locations should be detailed and accurate. 
-            Here are some examples of the types of responses you might provide:
-            Make sure the tone is relaxed and friendly, some jokes or light-hearted comments are always welcome.
-            
-            for information seeking queries, you should provide about 5 sentences of information about the location, guide the visitor to ask more questions if they want to know more.
-
-            ADDITIONAL INFORMATION:
-            {additional_info}
-
-            JSON example 1: location recommnedations:
-            {{
-                "locations": ['location 1', 'location 2', 'location 3', ..., 'location N'],
-                "speech": "Based on your preferences, what about try talking a walk from location 1 to location N? it should take you about 2 hours and you will see some interesting places on the way."
-            }}
-
-            JSON example 2: clarifying questions: the goal is to get more information from the visitor to refine the recommendations
-            {{
-                "locations": [],
-                "speech": "to get started, could you tell me a bit more about what you are interested in seeing? or how much time you would like to spent?"
-            }}
-            
-            JSON examples 3: general information: providing information about the point of interest
-            {{
-                "locations": [],
-                "speech": "Great Mall is built in 1992 and is the largest shopping mall in the city. It has over 200 stores and a food court with a variety of options."
-            }}
-
-            JSON examples 4: greeting: greeting the visitor
-            {{
-                "locations": [],
-                "speech": "Hello! I will help you explore the city and find the best places to visit. What would you like to see today?"
-            }}
 
-            JSON examples 5: revised recommendations: providing revised recommendations based on the visitor's feedback
-            !important: make sure the revised recommendations are similar to the original recommendations, but with some changes based on the visitor's feedback
-            !important: avoid making drastic changes to the recommendations
-            {{
-                "locations": ['location 1', 'location 2', 'location 3', ..., 'location N'], # it's important to keep the order of the locations similar to the original recommendations
-                "speech": "Based on what your preferences, I think you would enjoy visiting location 1, location 2, and location N. Would you like to know more about these places?"
-            }}
-
-            JSON examples 6: reset conversation: reset the conversation to the beginning, for example, if the visitor's says something like let's restart, start over, etc.
-            {{
-                "locations": [],
-                "speech": "Sure! Let's start over. What would you like to see today?"
-            }}
-
-            """,
-        }
-        self.conversation = []
-
-    def conversation_reset(self):
-        self.conversation = []
-
-    def get_wikipedia_article(self, query):
-
-        # Step 1: Perform the search to get article snippets
-        search_url = "https://en.wikipedia.org/w/api.php"
-        search_params = {
-            "action": "query",
-            "list": "search",
-            "srsearch": query,  # Replace with your search term
-            "format": "json",
-        }
+    async def warm_up(self):
+        """Open the upstream connections before traffic arrives"""
+        await asyncio.gather(self.http.warm(), self.model.warm())
 
-        search_response = requests.get(search_url, params=search_params)
-        search_data = search_response.json()
-
-        # Check if search results are available
-        if search_data.get("query") and search_data["query"].get("search"):
-            first_result = search_data["query"]["search"][0]
-            pageid = first_result["pageid"]
-
-            # Step 2: Retrieve the full article content using the pageid
-            article_url = "https://en.wikipedia.org/w/api.php"
-            article_params = {
-                "action": "query",
-                "prop": "extracts",
-                "pageids": pageid,
-                "explaintext": True,  # Returns plain text; remove for HTML content
-                "format": "json",
-            }
-
-            article_response = requests.get(article_url, params=article_params)
-            article_data = article_response.json()
-
-            # The extract is contained in the pages object, with the key as the pageid
-            full_article = article_data["query"]["pages"][str(pageid)]["extract"]
-            return full_article
-        else:
+    async def get_wikipedia_article(self, search, query=None):
+        """Passages of the best matching article that are relevant to the query"""
+        try:
+            key = ("wikipedia", normalize_query(search), normalize_query(query or ""))
+            with span("wikipedia"):
+                return await self.flights.do(key, self.wikipedia.context, search, query)
+        except Exception as e:
+            # 维基百科只是补充信息，超时或出错时不影响回答
+            tracing.log("error", stage="wikipedia", error=str(e) or type(e).__name__)
             return ""
 
-    def language_detection(self, query):
-        # use the query to determine the language
-        system_prompt = """
-            You will be provided with the user query.
-            based on the user query. Classify the language of the user query.
-
-            return the language type in the following json format:
-            {{
-                "language": "language"
-            }}
-
-            USER QUERY:
-            {query}
-        """
-
-        completion = self.model.chat_completion(
-            messages=[{"role": "system", "content": system_prompt.format(query=query)}],
-            response_format=Language,
-        )
-
-        return completion.choices[0].message.dict()["parsed"]["language"]
-
-    def get_nearby_landmarks(self, city):
-        """获取周边地标信息"""
-        params = {
-            "key": os.getenv("AMAP_KEY"),
-            "location": f"{city['longitude']},{city['latitude']}",  # 高德地图使用经度,纬度的顺序
-            "radius": 5000,  # 搜索半径，单位：米
-            "types": "110000",  # 景点类型，参考：https://lbs.amap.com/api/webservice/download
-            "extensions": "all",  # 返回结果控制
-            "offset": 20,  # 每页记录数据
-            "page": 1  # 当前页数
-        }
+    async def get_nearby_landmarks(self, city):
+        """获取周边地标信息，返回POI记录，到响应边界才转换成Location"""
+        latitude, longitude = float(city["latitude"]), float(city["longitude"])
+        # 本地索引的候选和高德的结果一起排序；索引里已经足够时不等高德，完整周边在后台收集进瓦片缓存
+        local = self.poi_index.query(latitude, longitude, NEARBY_RADIUS, self.landmarks.max_candidates)
+        wait = len(local) < self.poi_index_min_results
 
         try:
-            response = requests.get(
-                "https://restapi.amap.com/v3/place/around",
-                params=params
-            )
-            data = response.json()
-            print("API Response:", data)  # 打印完整响应
-            cityName = data.get("pois", [{}])[0].get("cityname", "unknown")
-            # 将响应保存到JSON文件
-            with open(f'amap_{cityName}.json', 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            
-            if data.get("pois"):
-                places = []
-                for poi in data["pois"]:
-                    try:
-                        location = poi["location"].split(",")
-                        print("location", location[0], location[1])
-                        
-                        # 更安全的rating处理
-                        rating = "0"
-                        if poi.get("biz_ext"):
-                            biz_ext = poi.get("biz_ext", {})
-                            rating_value = biz_ext.get("rating")
-                            if isinstance(rating_value, (str, int, float)):
-                                rating = str(rating_value)
-                            elif rating_value is None or rating_value == []:
-                                rating = "0"
-                            else:
-                                print(f"Unexpected rating value type: {type(rating_value)}")
-                                rating = "0"
-                        
-                        # 创建符合Location类要求的对象
-                        place = Location(
-                            latitude=location[1],
-                            longitude=location[0],
-                            displayName=poi["name"],
-                            rating=rating
-                        )
-                        places.append(place)
-                    except Exception as e:
-                        print(f"Error processing POI: {str(e)}")
-                        continue
-                return places
-            return []
+            # 同一位置（约1米内）的并发请求共用一次高德调用
+            key = ("landmarks", round(latitude, 5), round(longitude, 5))
+            return await self.flights.do(key, self.landmarks.nearby, latitude, longitude, local, wait)
         except Exception as e:
-            print(f"Error fetching landmarks from AMap: {str(e)}")
-            print(f"City data received: {city}")  # 打印输入的城市数据
-            return []
+            tracing.log("error", stage="landmarks", city=city, error=str(e))
+            return top_landmarks(local, latitude, longitude, NEARBY_RADIUS, NEARBY_PAGE_SIZE)
 
-    def infer_user_preferences(self):
-        # use the conversation to infer the user preferences
+    async def infer_user_preferences(self, preferences, new_turns):
+        # merge the preferences inferred so far with what the newest turns reveal
         system_prompt = """
             You are a professional Personal Tour Guide. You are taking a visitor on a city walk.
-            You will be provided the entire conversation history between the visitor and the assistant.
-            You will need to use this information to infer the visitor's interests and preferences.
-            collect the information from the conversation history and provide a list of preferences.
+            You will be provided the visitor's preferences inferred so far and the newest turns of the conversation between the visitor and the assistant.
+            You will need to use this information to update the visitor's interests and preferences.
+            Keep every existing preference unless the new turns contradict it, and add what the new turns reveal.
             The preferences should be a list of strings that represent the visitor's interests.
             For example, if the visitor mentioned that they like museums, you should include "museum" in the list of preferences.
             If the visitor mentioned that they like to walk, you should include "walking" in the list of preferences.
@@ -343,23 +234,30 @@ class CityWalkAgent:
                 "visited": ["museum", "park", "restaurant"]
             }}
 
-            CONVERSATION HISTORY:
+            PREFERENCES SO FAR:
+            {preferences}
+
+            NEW CONVERSATION TURNS:
             {conversations}
 
         """
 
         system_turn = [{
             "role": "system",
-            "content": system_prompt.format(conversations=json.dumps(self.conversation))
+            "content": system_prompt.format(
+                preferences=json.dumps(preferences or {}, ensure_ascii=False),
+                conversations="\n".join(f"Visitor: {turn['query']}\nGuide: {turn['speech']}" for turn in new_turns),
+            )
         }]
 
-        completion = self.model.chat_completion(
+        completion = await self.model.chat_completion(
             messages=system_turn,
-            response_format=Preferences
+            response_format=Preferences,
+            stage="preferences"
         )
         return completion.choices[0].message.dict()['parsed']
 
-    def search_location(self, location_name):
+    async def search_location(self, location_name):
         """使用高德地图搜索指定地点"""
         params = {
             "key": os.getenv("AMAP_KEY"),
@@ -369,11 +267,10 @@ class CityWalkAgent:
         }
 
         try:
-            response = requests.get(
-                "https://restapi.amap.com/v3/place/text",
-                params=params
-            )
-            data = response.json()
+            with span("amap.text"):
+                data = await self.flights.do(
+                    ("search", normalize_query(location_name)), self.http.amap.get_json, "/v3/place/text", params
+                )
             
             if data.get("status") == "1" and data.get("pois"):
                 poi = data["pois"][0]  # 获取第一个结果
@@ -392,28 +289,39 @@ class CityWalkAgent:
                 }
             return {}
         except Exception as e:
-            print(f"Error searching location from AMap: {str(e)}")
+            tracing.log("error", stage="amap.text", error=str(e))
             return {}
 
-    def is_location_information_seeking(self, query):
-        # use the query to determine if the user is seeking information
+    async def analyze_query(self, query, first_request, session):
+        """Language, translation and information-seeking classification in one call"""
+        if first_request:
+            with span("language"):
+                detected, confident = detect_language(query)
+            target_language = detected if confident else None
+        else:
+            target_language = session.language
 
+        # use the query and the conversation to classify it, all in one round trip
         system_prompt = """
             You will be provided with the user query and the conversation history between the visitor and the assistant.
-            based on the last user query and the conversation history, you need to determine if the user is seeking information.
-            if the user is seeking information about a specific location, you should return True, otherwise, return False.
-            when true, you should also return the location name that the user is seeking information about if multiple locations are mentioned in the query, return the most specific location.
-            Positive examples of the types of queries that the user might ask:
+
+            1. language: classify the language of the user query.
+            2. translated_query: {translation}
+            3. information_seeking: based on the last user query and the conversation history, determine if the user is seeking information.
+               if the user is seeking information about a specific location, return true, otherwise, return false.
+            4. location: when information_seeking is true, the location name that the user is seeking information about; if multiple locations are mentioned in the query, return the most specific location. Otherwise an empty string.
+
+            Positive examples of information seeking queries:
             - Tell me about the history of the city.
             - Introduction to the city.
             - Who lives in this place?
             - Tell me about place X in location Y.  #! important location X is the most specific location in the city so return location X
 
-            Negative examples of the types of queries that the user might ask:
+            Negative examples of information seeking queries:
             - What are some interesting places to visit in the city?
             - Can you recommend some good restaurants in the city?
             - What are the best places to visit in the city?
-        
+
             CONVERSATION HISTORY:
             {conversations}
 
@@ -422,115 +330,281 @@ class CityWalkAgent:
 
             response in the following JSON format:
             {{
-                "prediction": true | false
-                "location": "location name" | null
+                "language": "language",
+                "translated_query": "translated query",
+                "information_seeking": true | false,
+                "location": "location name" | ""
             }}
         """
-        completion = self.model.chat_completion(
+        if target_language is None:
+            translation = "the user query, unchanged."
+        else:
+            translation = f"the user query translated to {target_language}; if it already is in {target_language}, return it unchanged."
+
+        completion = await self.model.chat_completion(
             messages=[{
                 "role": "system",
-                "content": system_prompt.format(conversations=json.dumps(self.conversation), query=query)
+                "content": system_prompt.format(
+                    translation=translation,
+                    conversations=session.conversation.transcript(self.classifier_history_tokens),
+                    query=query,
+                )
             }],
-            response_format=InformationSeeking
+            response_format=QueryAnalysis,
+            stage="analysis"
         )
+        analysis = completion.choices[0].message.dict()["parsed"]
+        if first_request:
+            session.language = target_language or analysis["language"]
+        return {
+            "query": analysis["translated_query"] or query,
+            "loc_info": {"prediction": analysis["information_seeking"], "location": analysis["location"]},
+        }
 
-        return completion.choices[0].message.dict()['parsed']
-
-    def translate(self, text):
-        # translate the text to the user language
-        system_prompt = """
-            You will be provided with the text that needs to be translated to the target language.
-            Translate the text to the language of the user query.
-
-            return the translated text in the following json format:
-            {{
-                "translated_text": "translated text"
-            }}
-
-            TARGET LANGUAGE:
-            {target_language}
+    def needs_translation(self, query, first_request, session):
+        if first_request:
+            return False
+        detected, confident = detect_language(query)
+        return not (confident and detected == session.language)
+
+    async def location_context(self, loc_info, query):
+        # only needed when the visitor asks about a specific place
+        if not loc_info["prediction"]:
+            return None
+        location = loc_info["location"]
+        location_info, wikipedia = await asyncio.gather(
+            self.search_location(location),
+            self.get_wikipedia_article(location, query),
+        )
+        return {location: location_info, "wikipedia": wikipedia}
 
-            TEXT TO TRANSLATE:
-            {text}
-        """
+    async def prepare(self, query, metadata, first_request, session, cache_key=None):
+        """Gather everything the main completion needs"""
+        city = metadata.city.dict()
 
-        completion = self.model.chat_completion(
-            messages=[{
-                "role": "system",
-                "content": system_prompt.format(text=text, target_language=self.language)
-            }],
-            response_format=Translation
+        async def analysis():
+            return await self.analyze_query(query, first_request, session)
+
+        async def landmarks():
+            with span("landmarks"):
+                return await self.get_nearby_landmarks(city)
+
+        async def general_info(analysis=None):
+            # fetched speculatively alongside the classifier, it is only used
+            # when the query turns out not to be about a specific location
+            return await self.get_wikipedia_article(analysis["query"] if analysis else query)
+
+        async def location_info(analysis):
+            return await self.location_context(analysis["loc_info"], analysis["query"])
+
+        async def additional_info(location_info, general_info):
+            if location_info is not None:
+                return {"location_info": location_info}
+            return {"general_info": {"wikipedia": general_info}}
+
+        # a query already in the visitor's language can be searched right away,
+        # otherwise the search waits for its translation
+        translate = self.needs_translation(query, first_request, session)
+        graph = (
+            TaskGraph()
+            .add("analysis", analysis)
+            .add("landmarks", landmarks)
+            .add("general_info", general_info, deps=["analysis"] if translate else [])
+            .add("location_info", location_info, deps=["analysis"])
+            .add("additional_info", additional_info, deps=["location_info", "general_info"])
         )
+        with span("prepare"):
+            results = await graph.run()
+        query = results["analysis"]["query"]
+
+        history = session.conversation
+        landmarks = [poi.to_location() for poi in results["landmarks"]]
+        landmarks_ref = history.landmark_ref(landmarks)
+        new_message = history.user_message(city, landmarks_ref, query)
+        context = guide_context(session.language, results["additional_info"])
+
+        # an answer about a place is shared by visitors asking the same about it
+        # nearby, whatever the conversation that led there
+        loc_info = results["analysis"]["loc_info"]
+        if cache_key is None and self.responses.enabled and loc_info["prediction"] and loc_info["location"]:
+            cache_key = self.responses.key(
+                query, city["latitude"], city["longitude"], session.language,
+                normalize_query(loc_info["location"]), sorted(landmark["displayName"] for landmark in landmarks),
+            )
 
-        return completion.choices[0].message.dict()['parsed']['translated_text']
+        return {
+            "city": city,
+            "query": query,
+            "landmarks_ref": landmarks_ref,
+            "cache_key": cache_key,
+            "landmarks": landmarks,
+            "messages": guide_messages(history.messages(self.history_tokens, landmarks_ref), context, new_message),
+        }
 
-    def answer(self, query, metadata, first_request):
+    async def opening_key(self, query, metadata, first_request, session):
+        """Response cache key of an opening question, known before any LLM call"""
+        # later questions depend on the conversation, those about a place are
+        # keyed once the place is known, see prepare
+        if not self.responses.enabled or session.conversation.count:
+            return None
         if first_request:
-            self.language = self.language_detection(query)
+            detected, confident = detect_language(query)
+            language = detected if confident else ""
         else:
-            query = self.translate(query)
-        city = metadata.city.dict()
-        # time to get the landmarks
-        start = time.time()
-        landmarks = self.get_nearby_landmarks(city)
-        end = time.time()
-        # time to get the response
-        start = time.time()
-        new_message = {
-            "role": "user",
-            "content": json.dumps(
-                {
-                    "current_city": city,
-                    "near_by_landmarks": [landmark.dict() for landmark in landmarks],
-                    "new_query": query,
-                }
-            ),
+            language = session.language
+        latitude, longitude = float(metadata.city.latitude), float(metadata.city.longitude)
+        # stands in for the landmark set, which isn't looked up yet
+        version = await self.landmarks.version(latitude, longitude)
+        return self.responses.key(query, latitude, longitude, language, version)
+
+    def cached_response(self, cache_key, use_cache):
+        if not use_cache or cache_key is None:
+            return None
+        return self.responses.get(cache_key)
+
+    def replay(self, cached, metadata, session):
+        """A cached answer, recorded in the session as if it had just been given"""
+        session.language = cached["language"]
+        prepared = {
+            "city": metadata.city.dict(),
+            "query": cached["query"],
+            "landmarks_ref": session.conversation.landmark_ref(cached["landmarks"]),
+            "cache_key": None,
         }
+        return self.finish(prepared, cached["response"], session, cached=True)
+
+    def cached_events(self, response):
+        yield "speech", response.speech
+        for location in response.locations:
+            yield "location", location
+        yield "done", response
+
+    async def locate(self, prepared, names):
+        """Real coordinates for the recommended place names"""
+        city = prepared["city"]
+        with span("geocode"):
+            return await self.geocoder.resolve_all(
+                names, prepared["landmarks"], float(city["latitude"]), float(city["longitude"])
+            )
 
-        loc_info = self.is_location_information_seeking(query)
-
-        additional_info = {}
-
-        if loc_info["prediction"]:
-            location = loc_info["location"]
-            location_info = self.search_location(location)
-            additional_info["location_info"] = {location: location_info}
-            additional_info["location_info"]["wikipedia"] = self.get_wikipedia_article(
-                location
+    def route(self, prepared, locations):
+        """Order the locations into a walk from the visitor's position"""
+        city = prepared["city"]
+        with span("route"):
+            order, legs = order_stops(
+                (float(city["latitude"]), float(city["longitude"])),
+                [(float(location["latitude"]), float(location["longitude"])) for location in locations],
             )
-        else:
-            additional_info["general_info"] = {
-                "wikipedia": self.get_wikipedia_article(query)
-            }
-        new_system_prompt = {"role": "system", "content": self.system_prompt["content"]}
-        new_system_prompt["content"] = new_system_prompt["content"].format(
-            additional_info=json.dumps(additional_info), language=self.language
-        )
+        return [locations[i] for i in order], [round(leg) for leg in legs]
+
+    def finish(self, prepared, response, session, cached=False):
+        session.conversation.append(prepared["city"], prepared["landmarks_ref"], prepared["query"], response["speech"])
+        if prepared["cache_key"] is not None and not cached:
+            # what the next turns need from this one, so a hit doesn't have to prepare
+            self.responses.put(prepared["cache_key"], {
+                "response": response,
+                "language": session.language,
+                "query": prepared["query"],
+                "landmarks": prepared["landmarks"],
+            })
+        tracing.capture("response", response, cached=cached)
+        return CityWalkResponse(**response)  # 确保返回CityWalkResponse对象
 
-        completion = self.model.chat_completion(
-            messages=[new_system_prompt] + self.conversation + [new_message],
-            response_format=CityWalkResponse
+    async def answer(self, query, metadata, first_request, session, use_cache=True):
+        cache_key = await self.opening_key(query, metadata, first_request, session)
+        cached = self.cached_response(cache_key, use_cache)
+        if cached is not None:
+            return self.replay(cached, metadata, session)
+
+        prepared = await self.prepare(query, metadata, first_request, session, cache_key)
+        if cache_key is None:
+            cached = self.cached_response(prepared["cache_key"], use_cache)
+            if cached is not None:
+                return self.finish(prepared, cached["response"], session, cached=True)
+
+        completion = await self.model.chat_completion(
+            messages=prepared["messages"],
+            response_format=GuideResponse
         )
-        end = time.time()
-        print("completion", completion)
+        tracing.capture("completion", completion)
         response = completion.choices[0].message.dict()["parsed"]
-        new_response = {"role": "assistant", "content": response["speech"]}
-        self.conversation.append(new_message)
-        self.conversation.append(new_response)
+        locations = await self.locate(prepared, response["locations"])
+        response["locations"], response["legs"] = self.route(prepared, locations)
+        return self.finish(prepared, response, session)
+
+    async def answer_stream(self, query, metadata, first_request, session, use_cache=True):
+        """Like answer, but yields ("speech", text) and ("location", Location) events
+        while the completion streams in, and finally ("done", CityWalkResponse)
+        with the locations in walking order."""
+        cache_key = await self.opening_key(query, metadata, first_request, session)
+        cached = self.cached_response(cache_key, use_cache)
+        if cached is not None:
+            for item in self.cached_events(self.replay(cached, metadata, session)):
+                yield item
+            return
+
+        prepared = await self.prepare(query, metadata, first_request, session, cache_key)
+        if cache_key is None:
+            cached = self.cached_response(prepared["cache_key"], use_cache)
+            if cached is not None:
+                for item in self.cached_events(self.finish(prepared, cached["response"], session, cached=True)):
+                    yield item
+                return
+        parser = ResponseStreamParser()
+        # each name is resolved as soon as it has streamed in, and sent on in order
+        lookups = []
+        locations = {}
+
+        def resolved():
+            while lookups and lookups[0].done():
+                for location in lookups.pop(0).result():
+                    if location["displayName"] not in locations:
+                        locations[location["displayName"]] = location
+                        yield "location", Location(**location)
 
-        self.preferences = self.infer_user_preferences()
-        print("Response:", response)  # 打印响应内容
-        return CityWalkResponse(**response)  # 确保返回CityWalkResponse对象
+        try:
+            # the span covers the whole stream, time to first speech is the client's to measure
+            with span("completion"):
+                async with self.model.stream_completion(
+                    messages=prepared["messages"],
+                    response_format=GuideResponse
+                ) as stream:
+                    async for event in stream:
+                        if event.type != "content.delta":
+                            continue
+                        for kind, value in parser.feed(event.delta):
+                            if kind == "location":
+                                if isinstance(value, str):
+                                    lookups.append(asyncio.ensure_future(self.locate(prepared, [value])))
+                                continue
+                            yield kind, value
+                        for item in resolved():
+                            yield item
+                    completion = await stream.get_final_completion()
+            record_usage("completion", completion)
+            tracing.capture("completion", completion)
+            await asyncio.gather(*lookups)
+            for item in resolved():
+                yield item
+        finally:
+            # the client went away or the stream failed: nobody needs the lookups still running
+            for lookup in lookups:
+                lookup.cancel()
+
+        response = completion.choices[0].message.dict()["parsed"]
+        response["locations"], response["legs"] = self.route(prepared, list(locations.values()))
+        yield "done", self.finish(prepared, response, session)
 
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
+    from sessions import Session
 
     load_dotenv()
     agent = CityWalkAgent()
-    landmarks = agent.get_nearby_landmarks(
+    landmarks = asyncio.run(agent.get_nearby_landmarks(
         city={"latitude": 40.7128, "longitude": -74.0060}
-    )
+    ))
     print(landmarks)
     from pydantic import BaseModel
 
@@ -545,7 +619,10 @@ if __name__ == "__main__":
     city = City(latitude=40.7128, longitude=-74.0060)
     metadata = MetaData(city=city, is_first_request=True)
 
-    response = agent.answer(
-        "What are some interesting places to visit in New York?", metadata=metadata
-    )
+    response = asyncio.run(agent.answer(
+        "What are some interesting places to visit in New York?",
+        metadata=metadata,
+        first_request=metadata.is_first_request,
+        session=Session("cli"),
+    ))
     print(response)
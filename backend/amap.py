@@ -0,0 +1,48 @@
+import glob
+import json
+import os
+
+import tracing
+from poi_store import POI
+
+
+def parse_poi(poi):
+    """把高德POI转换成缓存和索引使用的精简记录"""
+    location = poi["location"].split(",")
+
+    # 更安全的rating处理
+    rating = 0.0
+    if poi.get("biz_ext"):
+        biz_ext = poi.get("biz_ext", {})
+        rating_value = biz_ext.get("rating")
+        if isinstance(rating_value, (str, int, float)):
+            rating = float(rating_value or 0)
+        elif rating_value is None or rating_value == []:
+            rating = 0.0
+        else:
+            tracing.log("warning", stage="amap.parse", error=f"Unexpected rating value type: {type(rating_value).__name__}")
+            rating = 0.0
+
+    typecode = poi.get("typecode")
+    return POI(
+        poi["id"],
+        poi["name"],
+        float(location[1]),
+        float(location[0]),
+        rating,
+        typecode if isinstance(typecode, str) else "",
+    )
+
+
+def load_amap_dumps(directory="."):
+    """Read every amap_*.json dump in a directory into parsed POIs."""
+    pois = []
+    for path in sorted(glob.glob(os.path.join(directory, "amap_*.json"))):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for poi in data.get("pois", []):
+            try:
+                pois.append(parse_poi(poi))
+            except Exception as e:
+                tracing.log("error", stage="amap.load", path=path, error=str(e))
+    return pois
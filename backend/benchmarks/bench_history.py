@@ -0,0 +1,108 @@
+"""Per-turn CPU of the conversation history over long sessions.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_history [--turns 60] [--budget 3000 100000]
+
+Each simulated turn does what a request does with the history: register the
+landmark set, build the prompt messages and the classifier transcript, append
+the turn and store the session. It is compared with re-encoding the whole
+history with `json.dumps` every turn, which is what a store and a prompt cost
+before the turns were kept encoded. The large budget keeps every turn in the
+prompt, so growth with the session length shows.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from sessions import Session
+
+CITY = {"latitude": "30.657", "longitude": "104.066", "city": "成都"}
+
+
+def landmark_sets(count, rng):
+    sets = []
+    for s in range(count):
+        sets.append([
+            {
+                "latitude": f"{30.65 + rng.uniform(-0.02, 0.02):.6f}",
+                "longitude": f"{104.06 + rng.uniform(-0.02, 0.02):.6f}",
+                "displayName": f"景点{s}-{i} Landmark with a longer name",
+                "rating": f"{rng.uniform(3, 5):.1f}",
+            }
+            for i in range(20)
+        ])
+    return sets
+
+
+def speech(turn, rng):
+    return " ".join(f"word{rng.randrange(1000)}" for _ in range(120)) + f" (turn {turn})"
+
+
+def turn_incremental(session, landmarks, query, answer, budget):
+    history = session.conversation
+    ref = history.landmark_ref(landmarks)
+    history.user_message(CITY, ref, query)
+    history.messages(budget, ref)
+    history.transcript(800)
+    history.append(CITY, ref, query, answer)
+    session.nbytes()
+
+
+def turn_reencoded(session, landmarks, query, answer, budget):
+    turn_incremental(session, landmarks, query, answer, budget)
+    history = session.conversation
+    # the whole history serialized again, for the prompt and for the store
+    json.dumps({ref: entry["landmarks"] for ref, entry in history.landmark_sets.items()}, ensure_ascii=False)
+    json.dumps(history.turns, ensure_ascii=False)
+    json.dumps(session.to_dict(), ensure_ascii=False)
+
+
+def run(turn_fn, turns, budget, rng):
+    sets = landmark_sets(8, rng)
+    answers = [speech(turn, rng) for turn in range(turns)]
+    session = Session("bench")
+    elapsed = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        turn_fn(session, sets[turn // 5 % len(sets)], f"What is near me now? ({turn})", answers[turn], budget)
+        elapsed.append(time.perf_counter() - start)
+    return elapsed, session
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--budget", type=int, nargs="+", default=[3000, 100000])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    for budget in args.budget:
+        print(f"budget {budget} tokens, {args.turns} turns, us per turn (first 10 / last 10 turns):")
+        for name, turn_fn in (("re-encoded", turn_reencoded), ("incremental", turn_incremental)):
+            first, last = [], []
+            for run_index in range(args.runs):
+                elapsed, session = run(turn_fn, args.turns, budget, random.Random(run_index))
+                first.append(statistics.mean(elapsed[:10]))
+                last.append(statistics.mean(elapsed[-10:]))
+            print(
+                f"  {name:12} {statistics.median(first) * 1e6:8.1f} / {statistics.median(last) * 1e6:8.1f}"
+                f"   ({len(session.conversation)} turns kept)"
+            )
+
+        # the encoded session still round-trips
+        _, session = run(turn_incremental, args.turns, budget, random.Random(0))
+        restored = Session.loads(session.dumps())
+        assert restored.conversation.to_dict() == session.conversation.to_dict()
+        assert restored.conversation.messages(budget) == session.conversation.messages(budget)
+        assert json.loads(session.dumps()) == json.loads(json.dumps(session.to_dict()))
+        store = time.perf_counter()
+        for _ in range(100):
+            session.dumps()
+        print(f"  session.dumps() {(time.perf_counter() - store) * 1e4:.1f} us, {len(session.dumps())} bytes\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Local POI index vs. the live AMap path.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_poi_index [--queries 10000]
+
+The live path is only timed when AMAP_KEY is set.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+
+from amap import load_amap_dumps
+from poi_index import POIIndex
+
+
+def bench_index(index, points, radius, k):
+    start = time.perf_counter()
+    for lat, lon in points:
+        index.query(lat, lon, radius, k)
+    return (time.perf_counter() - start) / len(points)
+
+
+async def bench_live(points, samples):
+    from agent import CityWalkAgent
+
+    agent = CityWalkAgent()
+    # bypass the local index and the tile cache so every call goes to AMap
+    agent.poi_index = POIIndex([])
+    timings = []
+    for lat, lon in points[:samples]:
+        agent.poi_cache.tiles.clear()
+        agent.poi_cache.areas.clear()
+        start = time.perf_counter()
+        await agent.get_nearby_landmarks({"latitude": lat, "longitude": lon})
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("--radius", type=float, default=5000)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--live-samples", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    pois = load_amap_dumps(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    start = time.perf_counter()
+    index = POIIndex(pois)
+    print(f"indexed {len(index)} POIs in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    # query points scattered around the dumped POIs
+    rng = random.Random(0)
+    points = []
+    for _ in range(args.queries):
+        i = rng.randrange(len(index))
+        points.append((float(index.lats[i]) + rng.uniform(-0.02, 0.02), float(index.lons[i]) + rng.uniform(-0.02, 0.02)))
+
+    per_query = bench_index(index, points, args.radius, args.k)
+    print(f"index: {per_query * 1e6:.1f} us/query over {len(points)} queries")
+
+    if not os.getenv("AMAP_KEY"):
+        print("live: skipped, AMAP_KEY is not set")
+        return
+    per_call = asyncio.run(bench_live(points, args.live_samples))
+    print(f"live:  {per_call * 1e3:.1f} ms/call over {args.live_samples} calls ({per_call / per_query:.0f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
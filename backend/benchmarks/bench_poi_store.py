@@ -0,0 +1,93 @@
+"""Memory and conversion cost of the POI representations.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_poi_store [--pois 100000]
+
+Synthetic POIs are cloned from the amap_*.json dumps with jittered
+coordinates, and each representation is measured with tracemalloc: the raw
+AMap payload, the plain dicts the caches used to hold, the `Location` models
+built for every landmark, `POI` records and `POIColumns`.
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from agent import Location
+from amap import parse_poi
+from poi_store import POIColumns
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_payload(count):
+    templates = []
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        if name.startswith("amap_") and name.endswith(".json"):
+            with open(os.path.join(BACKEND_DIR, name), encoding="utf-8") as f:
+                templates.extend(json.load(f).get("pois", []))
+    rng = random.Random(0)
+    pois = []
+    for i in range(count):
+        poi = copy.deepcopy(templates[i % len(templates)])
+        longitude, latitude = (float(part) for part in poi["location"].split(","))
+        poi["id"] = f"B{i:09d}"
+        poi["location"] = f"{longitude + rng.uniform(-0.05, 0.05):.6f},{latitude + rng.uniform(-0.05, 0.05):.6f}"
+        pois.append(poi)
+    return pois
+
+
+def measure(build):
+    """Bytes allocated by what `build` returns, and how long it took."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size, elapsed
+
+
+def per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pois", type=int, default=100000)
+    parser.add_argument("--landmarks", type=int, default=20, help="landmarks sent with one turn")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    raw, raw_size, _ = measure(lambda: synthetic_payload(args.pois))
+    records, records_size, records_time = measure(lambda: [parse_poi(poi) for poi in raw])
+    _, dicts_size, _ = measure(lambda: [poi.to_dict() for poi in records])
+    _, models_size, _ = measure(lambda: [Location(**poi.to_location()) for poi in records])
+    columns, columns_size, columns_time = measure(lambda: POIColumns(records))
+
+    print(f"{args.pois} POIs, bytes per POI:")
+    print(f"  raw AMap payload   {raw_size / args.pois:8.0f}")
+    print(f"  dicts              {dicts_size / args.pois:8.0f}")
+    print(f"  Location models    {models_size / args.pois:8.0f}")
+    print(f"  POI records        {records_size / args.pois:8.0f}   (parsed in {records_time * 1e6 / args.pois:.2f} us/POI)")
+    print(f"  POIColumns         {columns_size / args.pois:8.0f}   (built in {columns_time * 1e3:.1f} ms)")
+
+    turn = records[:args.landmarks]
+    indices = list(range(args.landmarks))
+    print(f"\none turn of {args.landmarks} landmarks, us:")
+    print(f"  Location models + .dict()   {per_call(lambda: [Location(**p.to_location()).dict() for p in turn], args.repeat) * 1e6:8.1f}")
+    print(f"  POI.to_location()           {per_call(lambda: [p.to_location() for p in turn], args.repeat) * 1e6:8.1f}")
+    print(f"  POIColumns.records()        {per_call(lambda: columns.records(indices), args.repeat) * 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Route ordering time and quality against nearest neighbour alone.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_routing [--stops 5 10 20 50 100] [--runs 50]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from routing import distance_matrix, nearest_neighbour, order_stops
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stops", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for count in args.stops:
+        elapsed, improvement = [], []
+        for _ in range(args.runs):
+            # stops scattered over a few kilometres, like a city walk
+            start = (30.65, 104.07)
+            stops = [(30.65 + rng.uniform(-0.03, 0.03), 104.07 + rng.uniform(-0.03, 0.03)) for _ in range(count)]
+
+            begin = time.perf_counter()
+            _, legs = order_stops(start, stops)
+            elapsed.append(time.perf_counter() - begin)
+
+            points = [start] + stops
+            dist = distance_matrix([p[0] for p in points], [p[1] for p in points])
+            path = nearest_neighbour(dist)
+            greedy = dist[path[:-1], path[1:]].sum()
+            improvement.append(1 - sum(legs) / greedy if greedy else 0.0)
+
+        print(f"{count:>4} stops: {np.mean(elapsed) * 1000:7.2f} ms mean, {np.max(elapsed) * 1000:7.2f} ms max, "
+              f"{np.mean(improvement) * 100:4.1f}% shorter than nearest neighbour")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Offline evaluation of recommendation quality against latency and tokens.
+
+Run from the backend directory:
+
+    python -m benchmarks.evaluate benchmarks/eval_sessions.jsonl [--concurrency 20] [--fake]
+
+Every line of the input is one visitor session:
+
+    {"id": "chengdu-1", "city": "成都", "latitude": 30.648, "longitude": 104.116,
+     "queries": ["What is worth seeing around here?", "Plan a two hour walk."]}
+
+Sessions are driven through CityWalkAgent in-process, a bounded number at a
+time. Every turn is recorded with its CityWalkResponse, per-stage timings and
+token usage (--out writes them as JSONL), and the recommended stops are scored:
+
+- known: share of stops that are POIs of the AMap dumps (--pois), matched by
+  name within --match-meters
+- distance: mean distance of the stops from where the visitor asked
+- backtracking: share of the walk that leads back towards the start point,
+  0 when every leg goes further out
+- rating: mean AMap rating of the rated stops
+
+Upstreams and models come from the environment (.env) as for the service;
+--fake runs against benchmarks.fake_upstreams instead, for comparing prompt
+and caching changes without spending quota. Compare configurations by saving
+reports with --save and --label.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pydantic
+from dotenv import load_dotenv
+
+from agent import CityWalkAgent
+from benchmarks.fake_upstreams import BACKEND_DIR
+from benchmarks.load_test import percentiles, stop_stack, wait_until_up
+from geo import haversine
+from geocode import match_landmark
+from metrics import start_request
+from poi_index import POIIndex
+from sessions import Session
+
+
+class City(pydantic.BaseModel):
+    name: str
+    latitude: float
+    longitude: float
+
+
+class MetaData(pydantic.BaseModel):
+    city: City
+    is_first_request: bool
+
+
+def load_sessions(path):
+    sessions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            session = json.loads(line)
+            session.setdefault("id", f"session-{number}")
+            sessions.append(session)
+    return sessions
+
+
+def backtracking(start, stops):
+    """Share of the route walked back towards the start point."""
+    walked = back = 0.0
+    previous = start
+    for stop in stops:
+        leg = haversine(*previous, *stop)
+        walked += leg
+        # getting closer to the start means covering ground already passed
+        back += min(leg, max(0.0, haversine(*start, *previous) - haversine(*start, *stop)))
+        previous = stop
+    return back / walked if walked else 0.0
+
+
+def score_turn(start, locations, index, match_meters):
+    stops = [(float(location["latitude"]), float(location["longitude"])) for location in locations]
+    known = 0
+    for location, (latitude, longitude) in zip(locations, stops):
+        nearby = [poi.to_location() for poi in index.query(latitude, longitude, match_meters, k=50, rating_weight=0, category_weight=0)]
+        if match_landmark(location["displayName"], nearby) is not None:
+            known += 1
+    ratings = [float(location["rating"]) for location in locations if float(location["rating"] or 0) > 0]
+    return {
+        "stops": len(stops),
+        "known": known,
+        "distance": float(np.mean([haversine(*start, *stop) for stop in stops])) if stops else None,
+        "backtracking": backtracking(start, stops) if len(stops) > 1 else None,
+        "rating": float(np.mean(ratings)) if ratings else None,
+        "rated": len(ratings),
+    }
+
+
+async def run_session(agent, spec, args, index, records):
+    session = Session(f"eval-{spec['id']}")
+    latitude, longitude = float(spec["latitude"]), float(spec["longitude"])
+    for turn, query in enumerate(spec["queries"]):
+        metadata = MetaData(
+            city=City(name=spec.get("city", ""), latitude=latitude, longitude=longitude),
+            is_first_request=turn == 0,
+        )
+        timings = start_request()
+        start = time.perf_counter()
+        record = {"session": spec["id"], "turn": turn, "query": query, "latitude": latitude, "longitude": longitude}
+        try:
+            response = await agent.answer(query, metadata, turn == 0, session, use_cache=not args.no_cache)
+            record["response"] = response.dict()
+            record["scores"] = score_turn((latitude, longitude), record["response"]["locations"], index, args.match_meters)
+        except Exception as e:
+            record["error"] = str(e) or type(e).__name__
+        record["seconds"] = time.perf_counter() - start
+        record.update(timings.to_dict())
+        records.append(record)
+
+
+async def drive(sessions, args, index):
+    agent = CityWalkAgent()
+    records = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(spec):
+        async with semaphore:
+            await run_session(agent, spec, args, index, records)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(bounded(spec) for spec in sessions))
+    finally:
+        agent.landmarks.cancel()
+        await agent.http.aclose()
+    return records, time.perf_counter() - start
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return float(np.mean(values)) if values else None
+
+
+def summarize(records, wall, label=None):
+    ok = [record for record in records if "error" not in record]
+    scores = [record["scores"] for record in ok]
+    stages, tokens = {}, {}
+    for record in ok:
+        for stage, seconds in record["stages"].items():
+            stages.setdefault(stage, []).append(seconds)
+        for stage, usage in record["tokens"].items():
+            for kind, count in usage.items():
+                tokens[kind] = tokens.get(kind, 0) + count
+    stops = sum(score["stops"] for score in scores)
+    return {
+        "label": label,
+        "turns": len(records),
+        "errors": len(records) - len(ok),
+        "wall_seconds": wall,
+        "throughput": len(ok) / wall if wall else 0.0,
+        "quality": {
+            "stops_per_turn": stops / len(scores) if scores else None,
+            "known": sum(score["known"] for score in scores) / stops if stops else None,
+            "distance": mean(score["distance"] for score in scores),
+            "backtracking": mean(score["backtracking"] for score in scores),
+            "rating": mean(score["rating"] for score in scores),
+            "rated": sum(score["rated"] for score in scores) / stops if stops else None,
+        },
+        "tokens_per_turn": {kind: count / len(ok) for kind, count in tokens.items()} if ok else {},
+        "end_to_end": dict(percentiles([record["seconds"] for record in ok]), count=len(ok)),
+        "stages": {stage: dict(percentiles(values), count=len(values)) for stage, values in sorted(stages.items())},
+    }
+
+
+def print_report(report):
+    quality = report["quality"]
+
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print(f"{report['label'] or 'run'}: {report['turns']} turns, {report['errors']} errors in "
+          f"{report['wall_seconds']:.1f} s, {report['throughput']:.1f} turns/s")
+    print(f"  stops/turn {fmt(quality['stops_per_turn'], '.1f')}   known {fmt(quality['known'], '.0%')}   "
+          f"distance {fmt(quality['distance'], '.0f')} m   backtracking {fmt(quality['backtracking'], '.0%')}   "
+          f"rating {fmt(quality['rating'], '.2f')} ({fmt(quality['rated'], '.0%')} rated)")
+    print("  tokens/turn " + "   ".join(f"{kind} {count:.0f}" for kind, count in report["tokens_per_turn"].items()))
+    print(f"  {'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in [("end_to_end", report["end_to_end"])] + list(report["stages"].items()):
+        if stats["p50"] is None:
+            continue
+        print(f"  {stage:<20}{stats['count']:>8}" + "".join(f"{stats[p] * 1000:>10.1f}" for p in ("p50", "p95", "p99")))
+
+
+def start_fakes(args, workdir):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(args.fake_port)],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        wait_until_up(f"{fake_url}/v3/place/text?keywords=ping", fake)
+    except Exception:
+        stop_stack([fake])
+        raise
+    empty_dir = os.path.join(workdir, "no_dumps")
+    os.makedirs(empty_dir)
+    os.environ.update(
+        OPENAI_API_KEY="eval",
+        AMAP_KEY="eval",
+        OPENAI_BASE_URL=fake_url + "/v1",
+        AMAP_BASE_URL=fake_url,
+        WIKIPEDIA_BASE_URL=fake_url,
+        WIKI_CACHE_DIR=os.path.join(workdir, "wiki_cache"),
+        POI_INDEX_DIR=BACKEND_DIR if args.local_index else empty_dir,
+    )
+    return [fake]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sessions", help="JSONL file of sessions")
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions in flight at once")
+    parser.add_argument("--limit", type=int, help="only the first N sessions")
+    parser.add_argument("--pois", default=BACKEND_DIR, help="directory of the amap_*.json dumps stops are checked against")
+    parser.add_argument("--match-meters", type=float, default=100)
+    parser.add_argument("--no-cache", action="store_true", help="skip the response cache")
+    parser.add_argument("--fake", action="store_true", help="run against benchmarks.fake_upstreams")
+    parser.add_argument("--fake-port", type=int, default=8900)
+    parser.add_argument("--local-index", action="store_true", help="with --fake, serve landmarks from the local index")
+    parser.add_argument("--label", help="name of the configuration, kept in the report")
+    parser.add_argument("--out", help="write every turn as JSONL")
+    parser.add_argument("--save", help="write the report as JSON")
+    args = parser.parse_args()
+
+    load_dotenv()
+    sessions = load_sessions(args.sessions)[:args.limit]
+    index = POIIndex.from_dumps(args.pois)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = start_fakes(args, workdir) if args.fake else []
+        try:
+            records, wall = asyncio.run(drive(sessions, args, index))
+        finally:
+            stop_stack(processes)
+
+    records.sort(key=lambda record: (record["session"], record["turn"]))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    report = summarize(records, wall, args.label)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
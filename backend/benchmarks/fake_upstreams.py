@@ -0,0 +1,324 @@
+"""Local stand-ins for the OpenAI, AMap and Wikipedia APIs.
+
+Run from the backend directory:
+
+    python -m benchmarks.fake_upstreams [--port 8900] [--llm-latency 0.4]
+
+and point the service at it:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+    AMAP_BASE_URL=http://127.0.0.1:8900
+    WIKIPEDIA_BASE_URL=http://127.0.0.1:8900
+
+Structured outputs are generated from the JSON schema the client sends, with
+realistic values for the response formats the agent uses. AMap replays the
+amap_*.json dumps and Wikipedia serves canned extracts. Every endpoint sleeps
+for an injected latency, jittered by +-50%. Prompt prefixes seen before are
+reported as cached tokens, the way OpenAI's prompt caching does, and halve
+the time to first token of the part they cover.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from geo import haversine
+from tokens import estimate_tokens
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DISPLAY_NAME = re.compile(r'"displayName":\s*"([^"]+)"')
+NEW_QUERY = re.compile(r'"new_query":\s*"([^"]*)"')
+USER_QUERY = re.compile(r"USER QUERY:\s*(.+?)\s*\n", re.S)
+
+SPEECH = (
+    "What a lovely afternoon for a walk! Starting right where you are, I would head to {first} first, "
+    "it is one of the spots locals love and it is only a short stroll away. From there the route "
+    "loops past a couple more places so you never have to backtrack, and the whole thing takes "
+    "about two hours at an easy pace. Would you like me to tell you more about any of them?"
+)
+ARTICLE = """{title} is a well known place that attracts visitors from across the country.
+It is often described as one of the highlights of the city.
+
+== History ==
+The history of {title} goes back several centuries. It was rebuilt a number of times,
+most recently in the twentieth century, when it took on the shape visitors see today.
+Many of the original structures survived and are protected as cultural heritage.
+
+== Architecture ==
+The architecture of {title} mixes traditional and modern elements. The main hall is
+decorated with carvings, and the gardens around it are laid out along a central axis.
+
+== Visiting ==
+{title} is open every day. The best time to visit is early in the morning, before the
+crowds arrive. Local guides offer walking tours in several languages.
+"""
+
+
+def jitter(seconds):
+    return seconds * random.uniform(0.5, 1.5) if seconds > 0 else 0
+
+
+def value_for(name, schema, defs, context):
+    """A plausible value for a JSON schema node."""
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].rsplit("/", 1)[-1]]
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            key: value_for(key, prop, defs, context)
+            for key, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        if name == "locations":
+            names = random.sample(context["landmarks"], min(3, len(context["landmarks"])))
+            if random.random() < 0.5:
+                # a place that is not among the nearby landmarks, so it has to be looked up
+                names.append("Wenshu Monastery")
+            return [value_for(name, schema["items"], defs, dict(context, landmark=n)) for n in names]
+        return [value_for(name, schema.get("items", {}), defs, context) for _ in range(random.randint(0, 2))]
+    if kind == "boolean":
+        return random.random() < context["information_seeking"]
+    if kind in ("integer", "number"):
+        return random.randint(1, 50)
+    if name in ("language", "languageCode"):
+        return "English"
+    if name in ("translated_query", "translated_text"):
+        return context["query"]
+    if name in ("location", "displayName", "locations"):
+        return context.get("landmark") or (context["landmarks"] or ["People's Park"])[0]
+    if name == "speech":
+        return SPEECH.format(first=(context["landmarks"] or ["the park"])[0])
+    if name == "latitude":
+        return f"{30.65 + random.uniform(-0.02, 0.02):.6f}"
+    if name == "longitude":
+        return f"{104.07 + random.uniform(-0.02, 0.02):.6f}"
+    if name == "rating":
+        return f"{random.uniform(3.5, 5):.1f}"
+    return "tea houses" if name in ("likes", "visited") else ""
+
+
+def request_context(messages, information_seeking):
+    text = "\n".join(message.get("content") or "" for message in messages)
+    queries = NEW_QUERY.findall(text) or USER_QUERY.findall(text)
+    return {
+        "query": queries[-1] if queries else "",
+        "landmarks": list(dict.fromkeys(DISPLAY_NAME.findall(text))),
+        "information_seeking": information_seeking,
+        "prompt_tokens": estimate_tokens(text),
+    }
+
+
+class PrefixCache:
+    """Remembers prompts by message prefix, like provider-side prompt caching."""
+
+    def __init__(self, max_entries=100000, min_tokens=1024, block=128):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self.block = block
+
+    def cached_tokens(self, messages):
+        digest = hashlib.sha1()
+        tokens, cached = 0, 0
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            tokens += estimate_tokens(message.get("content") or "")
+            key = digest.hexdigest()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                cached = tokens
+            else:
+                self.entries[key] = True
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if cached < self.min_tokens:
+            return 0
+        return cached // self.block * self.block
+
+
+def load_dumps(directory):
+    pois = []
+    for path in sorted(glob.glob(os.path.join(directory, "amap_*.json"))):
+        with open(path, encoding="utf-8") as f:
+            pois.extend(json.load(f).get("pois", []))
+    for poi in pois:
+        longitude, latitude = poi["location"].split(",")
+        poi["_coords"] = (float(latitude), float(longitude))
+    return pois
+
+
+def create_app(llm_latency=0.4, tokens_per_second=80.0, amap_latency=0.08, wiki_latency=0.15,
+               information_seeking=0.3, dump_dir=BACKEND_DIR):
+    app = FastAPI()
+    pois = load_dumps(dump_dir)
+    titles = {}
+    prefixes = PrefixCache()
+
+    def public(poi, **extra):
+        return {**{k: v for k, v in poi.items() if not k.startswith("_")}, **extra}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        context = request_context(body["messages"], information_seeking)
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]
+            schema = json_schema["schema"]
+            content = json.dumps(
+                value_for(json_schema["name"], schema, schema.get("$defs", schema.get("definitions", {})), context),
+                ensure_ascii=False,
+            )
+        else:
+            content = SPEECH.format(first="the park")
+        cached = min(prefixes.cached_tokens(body["messages"]), context["prompt_tokens"])
+        usage = {
+            "prompt_tokens": context["prompt_tokens"],
+            "completion_tokens": estimate_tokens(content),
+            "total_tokens": context["prompt_tokens"] + estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        created = int(time.time())
+        # time to first token, then a steady decoding rate
+        uncached = 1 - 0.5 * cached / max(context["prompt_tokens"], 1)
+        await asyncio.sleep(jitter(llm_latency) * uncached)
+
+        if not body.get("stream"):
+            await asyncio.sleep(usage["completion_tokens"] / tokens_per_second)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+
+        def chunk(delta, finish_reason=None, **extra):
+            choices = [] if delta is None else [
+                {"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}
+            ]
+            return "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": choices,
+                **extra,
+            }, ensure_ascii=False) + "\n\n"
+
+        async def stream():
+            yield chunk({"role": "assistant", "content": ""})
+            # roughly four characters per token
+            for start in range(0, len(content), 16):
+                await asyncio.sleep(4 / tokens_per_second)
+                yield chunk({"content": content[start:start + 16]})
+            yield chunk({}, finish_reason="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    def matching(keywords):
+        words = keywords.lower().split()
+        matches = [poi for poi in pois if any(word in poi["name"].lower() for word in words)]
+        if not matches and pois:
+            # unknown names still resolve, like AMap's fuzzy matching does
+            matches = [pois[zlib.crc32(keywords.encode("utf-8")) % len(pois)]]
+        return matches
+
+    @app.get("/v3/place/around")
+    async def place_around(location: str, radius: float = 3000, offset: int = 20, page: int = 1,
+                           keywords: str = None):
+        await asyncio.sleep(jitter(amap_latency))
+        longitude, latitude = (float(part) for part in location.split(","))
+        nearby = []
+        for poi in matching(keywords) if keywords else pois:
+            distance = haversine(latitude, longitude, *poi["_coords"])
+            if distance <= radius:
+                nearby.append((distance, poi))
+        nearby.sort(key=lambda item: item[0])
+        paged = nearby[(page - 1) * offset:page * offset]
+        return {
+            "status": "1",
+            "info": "OK",
+            "infocode": "10000",
+            "count": str(len(nearby)),
+            "suggestion": {"keywords": [], "cities": []},
+            "pois": [public(poi, distance=str(int(distance))) for distance, poi in paged],
+        }
+
+    @app.get("/v3/place/text")
+    async def place_text(keywords: str, offset: int = 20, page: int = 1):
+        await asyncio.sleep(jitter(amap_latency))
+        matches = matching(keywords)
+        paged = matches[(page - 1) * offset:page * offset]
+        return {
+            "status": "1",
+            "info": "OK",
+            "infocode": "10000",
+            "count": str(len(matches)),
+            "pois": [public(poi) for poi in paged],
+        }
+
+    @app.get("/w/api.php")
+    async def wikipedia(request: Request):
+        await asyncio.sleep(jitter(wiki_latency))
+        params = request.query_params
+        if params.get("list") == "search":
+            title = params.get("srsearch", "").strip().title() or "City"
+            pageid = zlib.crc32(title.encode("utf-8"))
+            titles[pageid] = title
+            return {"query": {"search": [{"pageid": pageid, "title": title, "ns": 0}]}}
+        pageid = params.get("pageids", "0")
+        title = titles.get(int(pageid), f"Page {pageid}")
+        return {"query": {"pages": {pageid: {"pageid": int(pageid), "title": title, "extract": ARTICLE.format(title=title)}}}}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--amap-latency", type=float, default=0.08)
+    parser.add_argument("--wiki-latency", type=float, default=0.15)
+    parser.add_argument("--information-seeking", type=float, default=0.3,
+                        help="share of queries classified as information seeking")
+    args = parser.parse_args()
+
+    app = create_app(
+        llm_latency=args.llm_latency,
+        tokens_per_second=args.tokens_per_second,
+        amap_latency=args.amap_latency,
+        wiki_latency=args.wiki_latency,
+        information_seeking=args.information_seeking,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Offline load test of /answer against local stand-ins for every upstream.
+
+Run from the backend directory:
+
+    python -m benchmarks.load_test [--sessions 100] [--concurrency 20] [--turns 4]
+
+Starts benchmarks.fake_upstreams and the service (uvicorn main:app) as
+subprocesses, replays concurrent multi-turn visitor sessions around the dumped
+POIs, and reports throughput and p50/p95/p99 latency end to end and per stage,
+using the Server-Timing header the service sends back.
+
+Save a run with --save baseline.json and check a later one against it with
+--baseline baseline.json; the run fails when a stage's p95 regresses by more
+than --max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_upstreams import BACKEND_DIR, load_dumps
+
+CONVERSATIONS = [
+    [
+        "Hi! What are some interesting places to visit around here?",
+        "I prefer quiet places, no shopping malls please.",
+        "Tell me more about the first one.",
+        "Great, can you plan a two hour walk?",
+        "What about somewhere to eat on the way?",
+    ],
+    [
+        "Tell me about the history of this area.",
+        "Who lived here in the past?",
+        "Which museums are nearby?",
+        "Is there a park I can rest in afterwards?",
+    ],
+    [
+        "你好，附近有什么好玩的地方吗？",
+        "我喜欢历史古迹。",
+        "第二个地方有什么故事？",
+        "帮我规划一条不走回头路的路线。",
+    ],
+]
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            stages[name] = float(params[4:]) / 1000
+    return stages
+
+
+async def run_session(client, index, args, starts, results):
+    rng = random.Random(index)
+    script = CONVERSATIONS[index % len(CONVERSATIONS)]
+    latitude, longitude = rng.choice(starts)
+    latitude += rng.uniform(-0.01, 0.01)
+    longitude += rng.uniform(-0.01, 0.01)
+    session_id = f"bench-{index}"
+
+    for turn in range(args.turns):
+        # visitors keep walking between turns
+        latitude += rng.uniform(-0.002, 0.002)
+        longitude += rng.uniform(-0.002, 0.002)
+        metadata = {
+            "city": {"name": "bench", "latitude": latitude, "longitude": longitude},
+            "is_first_request": turn == 0,
+        }
+        start = time.perf_counter()
+        try:
+            response = await client.post(
+                "/answer",
+                params={"query": script[turn % len(script)], "session_id": session_id},
+                json=metadata,
+            )
+            ok = response.status_code == 200 and "speech" in response.json()
+        except httpx.HTTPError:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        results.append({
+            "ok": ok,
+            "seconds": elapsed,
+            "stages": parse_server_timing(response.headers.get("server-timing")) if response is not None else {},
+        })
+
+
+async def drive(args, base_url):
+    pois = load_dumps(BACKEND_DIR)
+    starts = [poi["_coords"] for poi in pois] or [(30.65, 104.07)]
+    results = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(index):
+            async with semaphore:
+                await run_session(client, index, args, starts, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(args.sessions)))
+        wall = time.perf_counter() - start
+    return results, wall
+
+
+def summarize(results, wall):
+    stages = {}
+    for result in results:
+        if result["ok"]:
+            for stage, seconds in result["stages"].items():
+                stages.setdefault(stage, []).append(seconds)
+    ok = [result["seconds"] for result in results if result["ok"]]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": wall,
+        "throughput": len(ok) / wall if wall else 0.0,
+        "end_to_end": dict(percentiles(ok), count=len(ok)),
+        "stages": {stage: dict(percentiles(values), count=len(values)) for stage, values in sorted(stages.items())},
+    }
+
+
+def print_report(report):
+    print(f"{report['requests']} requests, {report['errors']} errors in {report['wall_seconds']:.1f} s, "
+          f"{report['throughput']:.1f} req/s")
+    print(f"{'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [("end_to_end", report["end_to_end"])] + list(report["stages"].items())
+    for stage, stats in rows:
+        if stats["p50"] is None:
+            continue
+        print(f"{stage:<20}{stats['count']:>8}" + "".join(f"{stats[p] * 1000:>10.1f}" for p in ("p50", "p95", "p99")))
+
+
+def regressions(report, baseline, max_regression):
+    found = []
+    rows = [("end_to_end", report["end_to_end"], baseline.get("end_to_end"))]
+    rows += [(stage, stats, baseline.get("stages", {}).get(stage)) for stage, stats in report["stages"].items()]
+    for stage, stats, before in rows:
+        if not before or before.get("p95") is None or stats["p95"] is None:
+            continue
+        if stats["p95"] > before["p95"] * (1 + max_regression):
+            found.append(f"{stage}: p95 {before['p95'] * 1000:.1f} ms -> {stats['p95'] * 1000:.1f} ms")
+    return found
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout} s")
+
+
+def start_stack(args, workdir):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(args.fake_port),
+         "--llm-latency", str(args.llm_latency), "--tokens-per-second", str(args.tokens_per_second),
+         "--amap-latency", str(args.amap_latency), "--wiki-latency", str(args.wiki_latency)],
+        cwd=BACKEND_DIR,
+    )
+    empty_dir = os.path.join(workdir, "no_dumps")
+    os.makedirs(empty_dir)
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        AMAP_KEY="bench",
+        OPENAI_BASE_URL=fake_url + "/v1",
+        AMAP_BASE_URL=fake_url,
+        WIKIPEDIA_BASE_URL=fake_url,
+        SERVER_TIMING_HEADER="true",
+        SESSION_BACKEND="memory",
+        POI_CACHE_DB_PATH="",
+        WIKI_CACHE_DIR=os.path.join(workdir, "wiki_cache"),
+        # without dumps to index, nearby landmarks come from (fake) AMap
+        POI_INDEX_DIR=BACKEND_DIR if args.local_index else empty_dir,
+        RESPONSE_CACHE_ENABLED="true" if args.response_cache else "false",
+        PYTHONPATH=BACKEND_DIR,
+    )
+    # run outside the backend directory, so nothing the service writes lands in the repository
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(f"{fake_url}/v3/place/text?keywords=ping", fake)
+        wait_until_up(f"http://127.0.0.1:{args.port}/readyz", service)
+    except Exception:
+        stop_stack([fake, service])
+        raise
+    return [fake, service]
+
+
+def stop_stack(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions in flight at once")
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--url", help="load an already running service instead of starting one")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--fake-port", type=int, default=8900)
+    parser.add_argument("--llm-latency", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--amap-latency", type=float, default=0.08)
+    parser.add_argument("--wiki-latency", type=float, default=0.15)
+    parser.add_argument("--local-index", action="store_true", help="serve landmarks from the amap_*.json index")
+    parser.add_argument("--response-cache", action="store_true", help="leave the response cache enabled")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--baseline", help="fail on p95 regressions against a saved report")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = [] if args.url else start_stack(args, workdir)
+        try:
+            results, wall = asyncio.run(drive(args, args.url or f"http://127.0.0.1:{args.port}"))
+        finally:
+            stop_stack(processes)
+
+    report = summarize(results, wall)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print("regression:", line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import math
+
+EARTH_RADIUS = 6371008.8  # 米
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geohash_encode(lat, lon, precision=6):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_bbox(geohash):
+    """Return (lat_min, lat_max, lon_min, lon_max) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def geohash_cell_size(precision):
+    """Return the (lat, lon) size in degrees of a geohash cell."""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def radius_bbox(lat, lon, radius):
+    """Degree bounding box of a circle of `radius` metres."""
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    dlon = math.degrees(radius / (EARTH_RADIUS * max(math.cos(math.radians(lat)), 1e-6)))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def geohashes_in_radius(lat, lon, radius, precision=6):
+    """Geohash cells that intersect the circle of `radius` metres around a point."""
+    lat_min, lat_max, lon_min, lon_max = radius_bbox(lat, lon, radius)
+    cell_lat, cell_lon = geohash_cell_size(precision)
+    cells = set()
+    # walk the bounding box at cell resolution; the extra step makes sure the
+    # cells on the far edges are included
+    steps_lat = int((lat_max - lat_min) / cell_lat) + 2
+    steps_lon = int((lon_max - lon_min) / cell_lon) + 2
+    for i in range(steps_lat):
+        for j in range(steps_lon):
+            cell = geohash_encode(min(lat_min + i * cell_lat, lat_max), min(lon_min + j * cell_lon, lon_max), precision)
+            if cell in cells:
+                continue
+            if bbox_distance(lat, lon, geohash_bbox(cell)) <= radius:
+                cells.add(cell)
+    return cells
+
+
+def bbox_distance(lat, lon, bbox):
+    """Distance in metres from a point to the nearest point of a bounding box."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return haversine(lat, lon, min(max(lat, lat_min), lat_max), min(max(lon, lon_min), lon_max))
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+
+import tracing
+from amap import parse_poi
+from geo import geohash_encode, haversine
+
+# 括号里通常是分店或入口，比如 "MAMMUT猛犸象(成都万象城店)"
+BRANCH = re.compile(r"[(（][^)）]*[)）]")
+NOT_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_name(name):
+    return NOT_WORD.sub("", BRANCH.sub("", name).lower())
+
+
+def match_landmark(name, landmarks):
+    """The nearby landmark a recommended name refers to, or None."""
+    wanted = normalize_name(name)
+    if not wanted:
+        return None
+    best, best_score = None, 0
+    for landmark in landmarks:
+        candidate = normalize_name(landmark["displayName"])
+        if not candidate:
+            continue
+        if candidate == wanted:
+            return landmark
+        # "宽窄巷子" 和 "宽窄巷子景区" 是同一个地方
+        if len(wanted) >= 2 and len(candidate) >= 2 and (wanted in candidate or candidate in wanted):
+            score = min(len(wanted), len(candidate))
+            if score > best_score:
+                best, best_score = landmark, score
+    return best
+
+
+class Geocoder:
+    """Resolves the place names the LLM recommends to real AMap POIs.
+
+    Names are matched against the nearby landmarks that went into the prompt
+    first; the rest are looked up concurrently with a keyword search around
+    the visitor, and the results are cached by name and area so the same
+    stops are only looked up once. Names that resolve to nothing nearby are
+    dropped instead of being shown with made-up coordinates.
+    """
+
+    def __init__(self, http, radius=20000, ttl=24 * 3600, max_entries=5000, precision=5):
+        self.http = http
+        self.radius = radius
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, http):
+        return cls(
+            http,
+            radius=int(os.getenv("GEOCODE_RADIUS_METERS", 20000)),
+            ttl=int(os.getenv("GEOCODE_CACHE_TTL_SECONDS", 24 * 3600)),
+            max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", 5000)),
+        )
+
+    async def lookup(self, name, latitude, longitude):
+        """Best AMap match for a name around a point, None when there is none."""
+        key = (normalize_name(name), geohash_encode(latitude, longitude, self.precision))
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        params = {
+            "key": os.getenv("AMAP_KEY"),
+            "keywords": name,
+            "location": f"{longitude},{latitude}",  # 高德地图使用经度,纬度的顺序
+            "radius": self.radius,
+            "sortrule": "weight",  # 按匹配度而不是距离排序
+            "offset": 5,
+            "page": 1,
+        }
+        data = await self.http.get_json("/v3/place/around", params)
+        if data.get("status") != "1":
+            return None
+        poi = None
+        for candidate in data.get("pois", []):
+            try:
+                poi = parse_poi(candidate)
+                break
+            except Exception as e:
+                tracing.log("error", stage="amap.parse", error=str(e))
+
+        self.entries[key] = (time.time(), poi)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return poi
+
+    async def resolve(self, name, landmarks, latitude, longitude):
+        """A Location-shaped dict for one recommended name, or None."""
+        landmark = match_landmark(name, landmarks)
+        if landmark is not None:
+            return landmark
+        try:
+            poi = await self.lookup(name, latitude, longitude)
+        except Exception as e:
+            tracing.log("error", stage="geocode", name=name, error=str(e) or type(e).__name__)
+            return None
+        if poi is None or haversine(latitude, longitude, poi.latitude, poi.longitude) > self.radius:
+            return None
+        return poi.to_location()
+
+    async def resolve_all(self, names, landmarks, latitude, longitude):
+        """Resolve every name at once, keeping their order and dropping duplicates and misses."""
+        names = list(dict.fromkeys(name for name in names if name.strip()))
+        resolved = await asyncio.gather(*(self.resolve(name, landmarks, latitude, longitude) for name in names))
+        locations, seen = [], set()
+        for location in resolved:
+            if location is None or location["displayName"] in seen:
+                continue
+            seen.add(location["displayName"])
+            locations.append(location)
+        return locations
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
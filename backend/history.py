@@ -0,0 +1,250 @@
+import hashlib
+from collections import Counter
+
+import orjson
+
+from tokens import estimate_tokens, truncate_tokens
+
+# turns folded into the summary together, see compact
+COMPACTION_BLOCK = 8
+
+LANDMARK_SETS_HEADER = "NEARBY LANDMARK SETS (user turns refer to these by id in near_by_landmarks):\n"
+
+
+def encode(value):
+    return orjson.dumps(value).decode("utf-8")
+
+
+class ConversationHistory:
+    """Conversation of one session, kept within a token budget.
+
+    Each distinct set of nearby landmarks is stored once and user turns refer
+    to it by id (e.g. "L1"), so walking around the same area doesn't resend the
+    same 20 POIs with every turn. Turns that no longer fit the budget are folded
+    into a rolling summary, which keeps the prompt size, and therefore latency,
+    constant over long walks.
+
+    Every turn is serialized once, when it is appended: its JSON, prompt
+    messages, transcript entry and token count are kept next to it, so the
+    prompt, the classifier transcript and the stored session are assembled
+    from ready parts and a turn costs the same at the 50th turn as at the first.
+    """
+
+    def __init__(self, turns=None, landmark_sets=None, summary=None, next_set=1, count=0):
+        self.turns = []
+        # number of turns ever appended, including those folded into the summary
+        self.count = count
+        self.landmark_sets = {}
+        self.summary = []
+        self.next_set = next_set
+
+        self.encoded = []
+        self.chat = []
+        self.entries = []
+        self.turn_tokens = 0
+        self.turn_bytes = 0
+        self.refs = Counter()
+        self.summary_token_count = 0
+        self.set_digests = {}
+        self.encoded_sets = {}
+        self.sets_message = None
+
+        for turn in turns or []:
+            self.push(turn)
+        for ref, entry in (landmark_sets or {}).items():
+            self.add_set(ref, entry)
+        for line in summary or []:
+            self.add_summary(line)
+
+    def to_dict(self):
+        return {
+            "turns": self.turns,
+            "landmark_sets": self.landmark_sets,
+            "summary": self.summary,
+            "next_set": self.next_set,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # sessions stored while the history kept a running digest still carry it
+        return cls(**{key: value for key, value in data.items() if key != "digest"})
+
+    def encode(self):
+        """`to_dict()` as JSON bytes, assembled from the encodings kept since the turns were appended."""
+        sets = b",".join(
+            b'"%s":{"digest":"%s","tokens":%d,"landmarks":%s}'
+            % (ref.encode(), entry["digest"].encode(), entry["tokens"], self.encoded_sets[ref].encode("utf-8"))
+            for ref, entry in self.landmark_sets.items()
+        )
+        rest = orjson.dumps({
+            "summary": self.summary,
+            "next_set": self.next_set,
+            "count": self.count,
+        })
+        return b'{"turns":[' + b",".join(self.encoded) + b'],"landmark_sets":{' + sets + b"}," + rest[1:]
+
+    def nbytes(self):
+        """Rough size of the encoded history, without encoding it."""
+        return (
+            self.turn_bytes
+            + sum(len(encoded) for encoded in self.encoded_sets.values())
+            + sum(len(line) for line in self.summary)
+        )
+
+    def __len__(self):
+        return len(self.turns)
+
+    def push(self, turn):
+        encoded = orjson.dumps(turn)
+        entry = f"Visitor: {turn['query']}\nGuide: {turn['speech']}"
+        self.turns.append(turn)
+        self.encoded.append(encoded)
+        self.chat.append({"role": "user", "content": turn["user"]})
+        self.chat.append({"role": "assistant", "content": turn["speech"]})
+        self.entries.append((entry, estimate_tokens(entry)))
+        self.turn_tokens += turn["tokens"]
+        self.turn_bytes += len(encoded)
+        self.refs[turn["landmarks"]] += 1
+        return encoded
+
+    def pop_oldest(self):
+        turn = self.turns.pop(0)
+        encoded = self.encoded.pop(0)
+        del self.chat[:2]
+        self.entries.pop(0)
+        self.turn_tokens -= turn["tokens"]
+        self.turn_bytes -= len(encoded)
+        self.refs[turn["landmarks"]] -= 1
+        if not self.refs[turn["landmarks"]]:
+            del self.refs[turn["landmarks"]]
+        return turn
+
+    def add_set(self, ref, entry, encoded=None):
+        self.landmark_sets[ref] = entry
+        self.set_digests[entry["digest"]] = ref
+        self.encoded_sets[ref] = encoded if encoded is not None else encode(entry["landmarks"])
+        self.sets_message = None
+
+    def remove_set(self, ref):
+        entry = self.landmark_sets.pop(ref)
+        del self.set_digests[entry["digest"]]
+        del self.encoded_sets[ref]
+        self.sets_message = None
+
+    def add_summary(self, line):
+        self.summary.append(line)
+        self.summary_token_count += estimate_tokens(line)
+
+    def landmark_ref(self, landmarks):
+        """Id of a landmark set, registering it the first time it is seen."""
+        # hashed without serializing, the set is only encoded the first time it is seen
+        key = "\x1f".join(
+            f"{landmark['displayName']}|{landmark['latitude']}|{landmark['longitude']}|{landmark['rating']}"
+            for landmark in landmarks
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        ref = self.set_digests.get(digest)
+        if ref is not None:
+            return ref
+        encoded = encode(landmarks)
+        ref = f"L{self.next_set}"
+        self.next_set += 1
+        self.add_set(ref, {"digest": digest, "landmarks": landmarks, "tokens": estimate_tokens(encoded)}, encoded)
+        return ref
+
+    def user_message(self, city, ref, query):
+        return {
+            "role": "user",
+            "content": encode({
+                "current_city": city,
+                "near_by_landmarks": ref,
+                "new_query": query,
+            }),
+        }
+
+    def append(self, city, ref, query, speech):
+        user = self.user_message(city, ref, query)
+        self.push({
+            "query": query,
+            "speech": speech,
+            "landmarks": ref,
+            "user": user["content"],
+            "tokens": estimate_tokens(user["content"]) + estimate_tokens(speech),
+        })
+        self.count += 1
+
+    def turns_since(self, count):
+        """Turns appended after the first `count`, as far as they haven't been summarized."""
+        return self.turns[max(len(self.turns) - (self.count - count), 0):]
+
+    def compact(self, budget, current_ref=None):
+        """Fold the oldest turns into the summary until the history fits `budget` tokens.
+
+        Turns are folded a whole block at a time, at fixed turn numbers, so the
+        turns that stay start at the same turn until the next compaction and
+        the prompt prefix they form stays cacheable upstream in between.
+        """
+        while self.turns and self.tokens(current_ref) > budget:
+            folded = self.count - len(self.turns)
+            for _ in range(min(COMPACTION_BLOCK - folded % COMPACTION_BLOCK, len(self.turns))):
+                turn = self.pop_oldest()
+                self.add_summary(
+                    f"- Visitor: {truncate_tokens(turn['query'], 60)}\n"
+                    f"  Guide: {truncate_tokens(turn['speech'], 60)}"
+                )
+        # the summary is rolling too: it never takes more than a quarter of the budget
+        while len(self.summary) > 1 and self.summary_tokens() > budget // 4:
+            self.summary_token_count -= estimate_tokens(self.summary.pop(0))
+
+        for ref in list(self.landmark_sets):
+            if ref not in self.refs and ref != current_ref:
+                self.remove_set(ref)
+
+    def summary_tokens(self):
+        return self.summary_token_count
+
+    def tokens(self, current_ref=None):
+        return (
+            self.summary_token_count
+            + self.turn_tokens
+            + sum(
+                entry["tokens"] for ref, entry in self.landmark_sets.items()
+                if ref in self.refs or ref == current_ref
+            )
+        )
+
+    def messages(self, budget, current_ref=None):
+        """Prompt messages for the history, compacted to `budget` tokens.
+
+        The turns come first: they only ever grow at the end, so they extend the
+        prompt prefix of the previous call, which keeps it cacheable upstream.
+        """
+        self.compact(budget, current_ref)
+        context = []
+        if self.summary:
+            context.append("EARLIER CONVERSATION, before the turns above (summary):\n" + "\n".join(self.summary))
+        if self.landmark_sets:
+            if self.sets_message is None:
+                self.sets_message = LANDMARK_SETS_HEADER + "{" + ",".join(
+                    f"{encode(ref)}:{encoded}" for ref, encoded in self.encoded_sets.items()
+                ) + "}"
+            context.append(self.sets_message)
+
+        messages = list(self.chat)
+        if context:
+            messages.append({"role": "system", "content": "\n\n".join(context)})
+        return messages
+
+    def transcript(self, budget):
+        """Plain-text recent conversation, without landmarks, for the classifier prompts."""
+        lines = []
+        used = 0
+        for entry, tokens in reversed(self.entries):
+            used += tokens
+            if used > budget:
+                break
+            lines.append(entry)
+        if self.summary and used + self.summary_token_count <= budget:
+            lines.append("\n".join(self.summary))
+        return "\n".join(reversed(lines))
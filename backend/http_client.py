@@ -0,0 +1,164 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+import tracing
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+USER_AGENT = "ai-map-rating/1.0 (city walk guide)"
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.request.url.host} returned {response.status_code}")
+        self.response = response
+
+
+RETRYABLE = (httpx.TransportError, RetryableStatus)
+
+
+class Upstream:
+    """Pooled, deadline-bounded JSON GETs against one upstream host.
+
+    Connections are kept alive between calls, each call has an overall
+    deadline covering all of its attempts, failed attempts are retried with
+    jittered exponential backoff, and the number of requests in flight is
+    capped so one slow upstream can't soak up every request. With
+    `hedge_after` set, an attempt that hasn't answered by then gets a second,
+    identical request and the first response wins.
+    """
+
+    def __init__(self, name, base_url, timeout=5.0, deadline=10.0, retries=2, backoff=0.2,
+                 max_concurrency=32, max_connections=64, hedge_after=None):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60,
+            ),
+            headers={"User-Agent": USER_AGENT},
+        )
+        self.requests = 0
+        self.retried = 0
+        self.hedged = 0
+
+    @classmethod
+    def from_env(cls, name, base_url, **defaults):
+        """Settings come from <NAME>_BASE_URL, <NAME>_TIMEOUT, <NAME>_DEADLINE, <NAME>_RETRIES,
+        <NAME>_MAX_CONCURRENCY and <NAME>_HEDGE_AFTER, falling back to `defaults`."""
+        prefix = name.upper()
+
+        def setting(key, cast, default):
+            value = os.getenv(f"{prefix}_{key}")
+            return cast(value) if value else default
+
+        hedge_after = setting("HEDGE_AFTER", float, defaults.get("hedge_after"))
+        return cls(
+            name,
+            setting("BASE_URL", str, base_url),
+            timeout=setting("TIMEOUT", float, defaults.get("timeout", 5.0)),
+            deadline=setting("DEADLINE", float, defaults.get("deadline", 10.0)),
+            retries=setting("RETRIES", int, defaults.get("retries", 2)),
+            max_concurrency=setting("MAX_CONCURRENCY", int, defaults.get("max_concurrency", 32)),
+            hedge_after=hedge_after or None,
+        )
+
+    async def get_json(self, path, params=None, deadline=None):
+        data = await asyncio.wait_for(self.with_retries(path, params), deadline or self.deadline)
+        tracing.capture(self.name, data, path=path, params=params)
+        return data
+
+    async def with_retries(self, path, params):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.hedge(path, params)
+            except RETRYABLE:
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def hedge(self, path, params):
+        if self.hedge_after is None:
+            return await self.attempt(path, params)
+
+        first = asyncio.ensure_future(self.attempt(path, params))
+        pending = {first}
+        error = None
+        # whatever is still pending when we leave, e.g. cancelled by the deadline, is cancelled too
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            pending.add(asyncio.ensure_future(self.attempt(path, params)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def attempt(self, path, params):
+        async with self.semaphore:
+            self.requests += 1
+            response = await self.client.get(path, params=params)
+        if response.status_code in RETRY_STATUS:
+            raise RetryableStatus(response)
+        response.raise_for_status()
+        return response.json()
+
+    async def warm(self, connections=2):
+        """Open `connections` pooled connections (DNS, TCP and TLS) ahead of the first call."""
+
+        async def connect():
+            try:
+                await self.client.get("/")
+            except httpx.HTTPError as e:
+                tracing.log("warning", stage=f"warm.{self.name}", error=str(e) or type(e).__name__)
+
+        await asyncio.gather(*(connect() for _ in range(connections)))
+
+    def stats(self):
+        return {"requests": self.requests, "retried": self.retried, "hedged": self.hedged}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class Upstreams:
+    """The outbound HTTP clients shared by everything that talks to AMap or Wikipedia."""
+
+    def __init__(self, amap, wikipedia):
+        self.amap = amap
+        self.wikipedia = wikipedia
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            amap=Upstream.from_env("amap", "https://restapi.amap.com", timeout=3.0, deadline=6.0, hedge_after=0.8),
+            wikipedia=Upstream.from_env("wikipedia", "https://en.wikipedia.org", timeout=5.0, deadline=8.0),
+        )
+
+    async def warm(self):
+        connections = int(os.getenv("WARM_CONNECTIONS", 2))
+        await asyncio.gather(self.amap.warm(connections), self.wikipedia.warm(connections))
+
+    async def aclose(self):
+        await asyncio.gather(self.amap.aclose(), self.wikipedia.aclose())
@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import math
+import os
+
+import numpy as np
+
+import tracing
+from amap import parse_poi
+from geo import geohash_encode, haversine
+from metrics import current_request, span
+
+# 高德类型编码前缀的权重：风景名胜优先于公园广场
+CATEGORY_WEIGHTS = {
+    "1102": 1.0,  # 风景名胜
+    "1101": 0.7,  # 公园广场
+}
+DEFAULT_CATEGORY_WEIGHT = 0.5
+
+
+def typecode_weight(typecode):
+    return CATEGORY_WEIGHTS.get(typecode[:4], DEFAULT_CATEGORY_WEIGHT)
+
+
+def score(rating, distance, category, radius, rating_weight=0.5, distance_weight=0.3, category_weight=0.2):
+    """Blend of the rating (out of 5), closeness to the visitor and the category weight.
+
+    Takes numbers or numpy arrays, so the local index ranks its columns the
+    same way AMap results are ranked here.
+    """
+    return (
+        rating_weight * np.minimum(rating, 5.0) / 5
+        + distance_weight * np.maximum(0.0, 1 - distance / radius)
+        + category_weight * category
+    )
+
+
+def score_poi(poi, distance, radius, **weights):
+    return float(score(poi.rating, distance, typecode_weight(poi.typecode), radius, **weights))
+
+
+def top_landmarks(pois, lat, lon, radius, k, local=()):
+    """The `k` best scored POIs within `radius` metres, best first.
+
+    `local` POIs (e.g. from the local index) are ranked along with them; a
+    POI both lists have counts once, as AMap returned it.
+    """
+    if local:
+        merged = {poi.id: poi for poi in local}
+        merged.update((poi.id, poi) for poi in pois)
+        pois = list(merged.values())
+    scored = []
+    for i, poi in enumerate(pois):
+        distance = haversine(lat, lon, poi.latitude, poi.longitude)
+        if distance <= radius:
+            # the index breaks ties so the dicts are never compared
+            scored.append((score_poi(poi, distance, radius), -i, poi))
+    return [poi for _, _, poi in heapq.nlargest(k, scored)]
+
+
+class LandmarkCollector:
+    """Nearby landmarks from every page of an AMap `place/around` search.
+
+    A request only waits for the first page. The remaining pages are then
+    fetched in the background, a few at a time, merged by POI id and stored in
+    the tile cache as a search that is complete for the whole radius, so the
+    following turns pick from the full neighbourhood. Each request gets the
+    top K candidates by rating, distance and category.
+
+    POIs of the local index are ranked together with the AMap ones. Where
+    the index already has enough of them, the request doesn't wait for AMap
+    at all: the whole search runs in the background and the tile cache
+    joins in for the following turns.
+    """
+
+    def __init__(self, http, poi_cache, radius=5000, types="110000", page_size=20, k=20,
+                 max_pages=25, max_parallel=4, max_candidates=200):
+        self.http = http
+        self.poi_cache = poi_cache
+        self.radius = radius
+        self.types = types
+        self.page_size = page_size
+        self.k = k
+        self.max_pages = max_pages
+        self.max_candidates = max_candidates
+        self.semaphore = asyncio.Semaphore(max_parallel)
+        # background collections by the geohash cell they started in
+        self.tasks = {}
+
+    @classmethod
+    def from_env(cls, http, poi_cache, **defaults):
+        return cls(
+            http,
+            poi_cache,
+            max_pages=int(os.getenv("LANDMARK_MAX_PAGES", 25)),
+            max_parallel=int(os.getenv("LANDMARK_PAGE_CONCURRENCY", 4)),
+            **defaults,
+        )
+
+    async def cache_call(self, fn, *args):
+        # the persistent layer hits SQLite, keep it off the event loop
+        if self.poi_cache.persistent:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def version(self, lat, lon):
+        """Changes whenever the landmarks `nearby` would rank around a point may have."""
+        return await self.cache_call(self.poi_cache.version, lat, lon, self.types)
+
+    async def nearby(self, lat, lon, local=(), wait=True):
+        """Top K of the AMap landmarks around a point and the `local` candidates.
+
+        Without a tile cache hit and with wait=False, only `local` is ranked
+        while the search runs in the background. AMap failing leaves `local`.
+        """
+        # the nearest few hundred are plenty to rank, and the cache can answer
+        # with them long before the visitor has walked out of the searched area
+        cached = await self.cache_call(
+            self.poi_cache.query, lat, lon, self.radius, self.types, self.max_candidates
+        )
+        if cached is not None:
+            return top_landmarks(cached, lat, lon, self.radius, self.k, local)
+        if not wait:
+            self.refresh(lat, lon)
+            return top_landmarks([], lat, lon, self.radius, self.k, local)
+
+        data = await self.fetch_page(lat, lon, 1)
+        if data.get("status") != "1":
+            return top_landmarks([], lat, lon, self.radius, self.k, local)
+        # 原始响应由 tracing 抽样保存，amap_*.json 用 python -m tracing export 导出
+        pois = self.parse(data)
+        total = int(data.get("count", 0))
+        await self.store(lat, lon, pois, total)
+        if total > len(pois):
+            self.collect_rest(lat, lon, pois, total)
+        return top_landmarks(pois, lat, lon, self.radius, self.k, local)
+
+    async def fetch_page(self, lat, lon, page):
+        params = {
+            "key": os.getenv("AMAP_KEY"),
+            "location": f"{lon},{lat}",  # 高德地图使用经度,纬度的顺序
+            "radius": self.radius,  # 搜索半径，单位：米
+            "types": self.types,  # 景点类型，参考：https://lbs.amap.com/api/webservice/download
+            "extensions": "all",  # 返回结果控制
+            "offset": self.page_size,  # 每页记录数据
+            "page": page  # 当前页数
+        }
+        with span("amap.around"):
+            return await self.http.get_json("/v3/place/around", params)
+
+    def parse(self, data):
+        pois = []
+        for poi in data.get("pois", []):
+            try:
+                pois.append(parse_poi(poi))
+            except Exception as e:
+                tracing.log("error", stage="amap.parse", error=str(e))
+        return pois
+
+    async def store(self, lat, lon, pois, total):
+        # 高德按距离排序返回，结果被截断时只有最远POI以内的范围是完整的
+        complete_radius = self.radius
+        if pois and total > len(pois):
+            complete_radius = max(haversine(lat, lon, poi.latitude, poi.longitude) for poi in pois)
+        await self.cache_call(self.poi_cache.store, lat, lon, complete_radius, self.types, pois)
+
+    def refresh(self, lat, lon):
+        cell = geohash_encode(lat, lon, self.poi_cache.precision)
+        if cell in self.tasks:
+            return
+        task = asyncio.create_task(self.search(lat, lon))
+        self.tasks[cell] = task
+        task.add_done_callback(lambda _: self.tasks.pop(cell, None))
+
+    async def search(self, lat, lon):
+        # every page, in the background, for the turns to come
+        current_request.set(None)
+        try:
+            data = await self.fetch_page(lat, lon, 1)
+            if data.get("status") != "1":
+                return
+            pois = self.parse(data)
+            total = int(data.get("count", 0))
+            if total > len(pois):
+                await self.collect(lat, lon, pois, total)
+            else:
+                await self.store(lat, lon, pois, total)
+        except Exception as e:
+            tracing.log("error", stage="landmarks.refresh", error=str(e) or type(e).__name__)
+
+    def collect_rest(self, lat, lon, first_page, total):
+        cell = geohash_encode(lat, lon, self.poi_cache.precision)
+        if cell in self.tasks:
+            return
+        task = asyncio.create_task(self.collect(lat, lon, first_page, total))
+        self.tasks[cell] = task
+        task.add_done_callback(lambda _: self.tasks.pop(cell, None))
+
+    async def collect(self, lat, lon, first_page, total):
+        # started while serving a request, but not part of it
+        current_request.set(None)
+        pages = min(math.ceil(total / self.page_size), self.max_pages)
+
+        async def fetch(page):
+            # only the background pages are throttled, first pages never wait for them
+            async with self.semaphore:
+                return await self.fetch_page(lat, lon, page)
+
+        try:
+            results = await asyncio.gather(*(fetch(page) for page in range(2, pages + 1)), return_exceptions=True)
+            merged = {poi.id: poi for poi in first_page}
+            for data in results:
+                # 中间某页失败时，只保留连续成功的前几页，这样完整半径仍然成立
+                if isinstance(data, BaseException) or data.get("status") != "1":
+                    break
+                for poi in self.parse(data):
+                    merged.setdefault(poi.id, poi)
+            await self.store(lat, lon, list(merged.values()), total)
+        except Exception as e:
+            tracing.log("error", stage="landmarks.collect", error=str(e) or type(e).__name__)
+
+    def cancel(self):
+        """Stop the background collections, e.g. on shutdown."""
+        for task in list(self.tasks.values()):
+            task.cancel()
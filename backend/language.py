@@ -0,0 +1,65 @@
+import re
+from collections import Counter
+
+# 按文字系统判断的语言，覆盖绝大多数游客的提问
+SCRIPTS = [
+    ("Japanese", re.compile(r"[぀-ヿ]")),
+    ("Korean", re.compile(r"[가-힯ᄀ-ᇿ]")),
+    ("Chinese", re.compile(r"[㐀-䶿一-鿿]")),
+    ("Russian", re.compile(r"[Ѐ-ӿ]")),
+    ("Arabic", re.compile(r"[؀-ۿ]")),
+    ("Hebrew", re.compile(r"[֐-׿]")),
+    ("Greek", re.compile(r"[Ͱ-Ͽ]")),
+    ("Thai", re.compile(r"[฀-๿]")),
+    ("Hindi", re.compile(r"[ऀ-ॿ]")),
+]
+
+# Latin-script languages are told apart by their most frequent short words
+STOPWORDS = {
+    "English": "the a an and is are of to in what where how can you me i my it this that there some "
+               "tell about for with near here should see do does we our like want",
+    "Spanish": "el la los las de que y en un una es por para con qué dónde cómo puedo me mi aquí "
+               "hay algo sobre cerca quiero ver lugares",
+    "French": "le la les de des et est un une que qui en pour avec où comment je me mon ici il y a "
+              "quoi sur près voir veux endroits",
+    "German": "der die das und ist ein eine zu in den von mit wo wie ich mir mein hier gibt es "
+              "über nähe sehen möchte orte was",
+    "Italian": "il lo la gli le di che e è un una per con dove come posso mi mio qui ci sono "
+               "cosa vicino vedere voglio luoghi",
+    "Portuguese": "o a os as de que e é um uma para com onde como posso me meu aqui há sobre "
+                  "perto ver quero lugares você",
+    "Dutch": "de het een en is van in wat waar hoe ik mij mijn hier er zijn over dichtbij zien "
+             "wil plekken",
+}
+STOPWORDS = {language: set(words.split()) for language, words in STOPWORDS.items()}
+WORD = re.compile(r"[^\W\d_]+")
+
+
+def detect_language(text):
+    """Guess the language of a query locally.
+
+    Returns (language, confident). Non-Latin scripts are identified by their
+    characters; Latin-script languages by stopword overlap, which is only
+    trusted when one language clearly wins.
+    """
+    letters = [c for c in text if c.isalpha()]
+    if not letters:
+        return None, False
+
+    counts = Counter()
+    for language, pattern in SCRIPTS:
+        counts[language] = len(pattern.findall(text))
+    # kana only appears in Japanese, while kanji alone would look Chinese
+    if counts["Japanese"]:
+        return "Japanese", True
+    language, count = counts.most_common(1)[0]
+    if count and count >= len(letters) / 3:
+        return language, True
+
+    words = [word.lower() for word in WORD.findall(text)]
+    scores = Counter({language: sum(word in stopwords for word in words) for language, stopwords in STOPWORDS.items()})
+    ranked = scores.most_common(2)
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    confident = best_score >= 2 and best_score >= 2 * runner_up
+    return (best, confident) if best_score else (None, False)
@@ -1,10 +1,26 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# 启动耗时从进程导入应用开始计算
+STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from agent import CityWalkAgent, CityWalkResponse
+from metrics import export, span, start_request
+from models import CityWalkResponse
+import tracing
+from prefetch import Prefetcher
+from preferences import PreferenceUpdater
+from sessions import SessionManager
+from startup import Startup
+import asyncio
+import importlib
+import json
 import os
 import sys
+import uuid
 
 # 加载环境变量
 load_dotenv()
@@ -16,10 +32,7 @@ if missing_vars:
     print(f"错误: 缺少必要的环境变量: {', '.join(missing_vars)}")
     print("请在 .env 文件中设置这些变量")
     sys.exit(1)
-else:
-    print("AMAP_KEY", os.getenv("AMAP_KEY"))
-    print("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY"))
-# 设置OpenAI API密钥
+
 app = FastAPI()
 
 app.add_middleware(
@@ -28,9 +41,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id", "Server-Timing", "X-Token-Usage"],
 )
 
-agent = CityWalkAgent()
+# the agent and everything hanging off it are built by warm_up, after the server is listening
+agent = None
+preferences = None
+prefetcher = None
+sessions = SessionManager.from_env()
+startup = Startup(STARTED)
+# 预热完成前到达的请求最多等待这么久，之后返回503
+startup_wait = float(os.getenv("STARTUP_WAIT_SECONDS", 30))
+# 前面的反向代理层数，每层在 X-Forwarded-For 末尾追加它看到的来源地址
+forwarded_hops = int(os.getenv("FORWARDED_HOPS", 0))
+# 每个请求的分阶段耗时，也可以用请求头 X-Debug-Timing: 1 单独开启
+timing_header = os.getenv("SERVER_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+def load_poi_index():
+    from poi_index import POIIndex
+    return POIIndex.from_env()
+
+async def warm_up(startup):
+    global agent, preferences, prefetcher
+    # the agent module pulls in the OpenAI SDK, import it while the POI dumps load
+    agent_module, poi_index = await asyncio.gather(
+        startup.step("import", importlib.import_module, "agent"),
+        startup.step("poi_index", load_poi_index),
+    )
+    warm_agent = await startup.step("agent", agent_module.CityWalkAgent, poi_index)
+    await asyncio.gather(
+        startup.step("poi_cache", warm_agent.poi_cache.preload),
+        startup.step("connections", warm_agent.warm_up),
+    )
+    agent = warm_agent
+    preferences = PreferenceUpdater(agent, sessions)
+    prefetcher = Prefetcher.from_env(agent)
+
+async def ready(timeout=None):
+    if not await startup.wait(startup_wait if timeout is None else timeout):
+        raise HTTPException(status_code=503, detail="warming up" if startup.error is None else "startup failed")
+
+@app.on_event("startup")
+async def start():
+    startup.start(warm_up)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await startup.stop()
+    if agent is not None:
+        await preferences.drain()
+        prefetcher.cancel()
+        agent.landmarks.cancel()
+        await agent.http.aclose()
+    tracing.close()
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 class Landmark(BaseModel):
     name: str
@@ -46,19 +118,135 @@ class MetaData(BaseModel):
     city: City
     is_first_request: bool
 
+def client_address(request):
+    """Address of the visitor as seen by the outermost proxy we run behind."""
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # entries to the left of what our own proxies appended are whatever the client sent
+    if forwarded_hops and len(forwarded) >= forwarded_hops:
+        return forwarded[-forwarded_hops]
+    return request.client.host
+
+def wants_timing(x_debug_timing):
+    return timing_header or (x_debug_timing or "").lower() in ("1", "true", "yes")
+
+def use_cache(no_cache, cache_control):
+    # ?no_cache=true 或 Cache-Control: no-cache 跳过响应缓存
+    return not no_cache and "no-cache" not in (cache_control or "").lower()
+
 @app.post("/answer", response_model=CityWalkResponse)
-async def answer(query: str, metadata: MetaData = None) -> CityWalkResponse:
+async def answer(
+    query: str,
+    response: Response,
+    metadata: MetaData = None,
+    session_id: str = None,
+    x_session_id: str = Header(None),
+    no_cache: bool = False,
+    cache_control: str = Header(None),
+    x_debug_timing: str = Header(None),
+) -> CityWalkResponse:
     """
     调用CityWalkAgent回答问题
     """
+    # 没有会话ID的请求分配一个新的，由客户端在后续请求中带回
+    await ready()
+    session_id = session_id or x_session_id or uuid.uuid4().hex
+    response.headers["X-Session-Id"] = session_id
+    timings = start_request()
     try:
-        if metadata.is_first_request:
-            agent.conversation_reset()
-        return agent.answer(query, metadata, metadata.is_first_request)
+        with span("answer"):
+            async with sessions.session(session_id, reset=metadata.is_first_request) as session:
+                result = await agent.answer(
+                    query, metadata, metadata.is_first_request, session, use_cache=use_cache(no_cache, cache_control)
+                )
+        # 偏好推断在返回响应后于后台进行
+        preferences.schedule(session_id)
+        if wants_timing(x_debug_timing):
+            response.headers["Server-Timing"] = timings.server_timing()
+            response.headers["X-Token-Usage"] = timings.token_usage()
+        return result
     except Exception as e:
-        print(f"Error talking to agent: {str(e)}")
+        tracing.log("error", stage="answer", error=str(e))
         return HTTPException(status_code=500, detail=str(e))
 
+@app.post("/prefetch", status_code=202)
+async def prefetch(
+    city: City,
+    request: Request,
+    response: Response,
+):
+    """
+    地图停止移动时预取该区域的周边地标和维基百科信息，语音问题到达时只剩LLM调用
+    """
+    # 预取只是优化，预热期间不排队
+    await ready(timeout=0)
+    # 按来源地址限流：会话ID由客户端决定，换一个就能绕过限制
+    status = prefetcher.schedule(client_address(request), city.dict())
+    if status == "throttled":
+        response.status_code = 429
+        response.headers["Retry-After"] = str(max(1, round(prefetcher.min_interval)))
+    return {"status": status}
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/answer/stream")
+async def answer_stream(
+    query: str,
+    metadata: MetaData = None,
+    session_id: str = None,
+    x_session_id: str = Header(None),
+    no_cache: bool = False,
+    cache_control: str = Header(None),
+    x_debug_timing: str = Header(None),
+):
+    """
+    流式回答：以SSE推送speech片段和解析出的每个location，最后推送完整响应
+    """
+    await ready()
+    session_id = session_id or x_session_id or uuid.uuid4().hex
+
+    async def events():
+        timings = start_request()
+        try:
+            with span("answer.stream"):
+                async with sessions.session(session_id, reset=metadata.is_first_request) as session:
+                    async for event, value in agent.answer_stream(
+                        query, metadata, metadata.is_first_request, session, use_cache=use_cache(no_cache, cache_control)
+                    ):
+                        if event == "speech":
+                            yield sse(event, {"text": value})
+                        else:
+                            yield sse(event, value.dict())
+            preferences.schedule(session_id)
+            # 响应头已经发出，耗时放在最后一个事件里
+            if wants_timing(x_debug_timing):
+                yield sse("timings", timings.to_dict())
+        except Exception as e:
+            tracing.log("error", stage="answer.stream", error=str(e))
+            yield sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"X-Session-Id": session_id, "Cache-Control": "no-cache"},
+    )
+
+@app.get("/metrics")
+async def metrics():
+    components = {"startup": startup.stats(), "tracing": tracing.get_tracer().stats()}
+    if agent is not None:
+        components.update({
+            "responses": agent.responses.stats(),
+            "poi_tiles": {"hits": agent.poi_cache.hits, "misses": agent.poi_cache.misses},
+            "geocode": agent.geocoder.stats(),
+            "singleflight": agent.flights.stats(),
+            "prefetch": prefetcher.stats(),
+            "amap": agent.http.amap.stats(),
+            "wikipedia": agent.http.wikipedia.stats(),
+        })
+    body, content_type = export(components)
+    return Response(body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,96 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+STAGE_SECONDS = Histogram(
+    "citywalk_stage_seconds",
+    "Latency of each CityWalkAgent stage",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+STAGE_ERRORS = Counter("citywalk_stage_errors_total", "Stages that raised", ["stage"])
+TOKENS = Counter("citywalk_tokens_total", "Tokens reported by the LLM, per stage", ["stage", "kind"])
+STATS = Gauge("citywalk_stats", "Cache and upstream counters, refreshed on every scrape", ["component", "counter"])
+
+# spans of the request being served; asyncio tasks inherit it, so the steps of
+# the task graph all report into the same request
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.spans = []
+        self.tokens = {}
+
+    def stage_totals(self):
+        totals = {}
+        for stage, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def server_timing(self):
+        """Value for the Server-Timing response header."""
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stage_totals().items())
+
+    def token_usage(self):
+        """Value for the X-Token-Usage response header, e.g. completion;prompt=1800;completion=90;cached=1536"""
+        return ", ".join(
+            stage + "".join(f";{kind}={count}" for kind, count in usage.items())
+            for stage, usage in self.tokens.items()
+        )
+
+    def to_dict(self):
+        return {"stages": self.stage_totals(), "tokens": self.tokens}
+
+
+def start_request():
+    timings = RequestTimings()
+    current_request.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage):
+    """Time a stage, for both the Prometheus histogram and the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = current_request.get()
+        if timings is not None:
+            timings.spans.append((stage, elapsed))
+
+
+def record_usage(stage, completion):
+    """Count the prompt, completion and cached prompt tokens an OpenAI response reports."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    counts = {
+        "prompt": usage.prompt_tokens,
+        "completion": usage.completion_tokens,
+        # prompt tokens served from the provider's prefix cache
+        "cached": (getattr(details, "cached_tokens", None) or 0) if details is not None else 0,
+    }
+    timings = current_request.get()
+    entry = timings.tokens.setdefault(stage, dict.fromkeys(counts, 0)) if timings is not None else None
+    for kind, count in counts.items():
+        TOKENS.labels(stage, kind).inc(count)
+        if entry is not None:
+            entry[kind] += count
+
+
+def export(components):
+    """Prometheus exposition of every metric, with `components` as {name: stats dict}."""
+    for name, stats in components.items():
+        for counter, value in stats.items():
+            STATS.labels(name, counter).set(value)
+    return generate_latest(), CONTENT_TYPE_LATEST
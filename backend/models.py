@@ -0,0 +1,18 @@
+"""API response models, kept apart from the agent so the app can declare its
+routes without importing the OpenAI SDK and the rest of the agent."""
+import pydantic
+
+
+class Location(pydantic.BaseModel):
+    latitude: str
+    longitude: str
+    displayName: str
+    rating: str
+
+
+class CityWalkResponse(pydantic.BaseModel):
+    speech: str
+    # in walking order, starting from the visitor
+    locations: list[Location]
+    # metres of every leg, the first one from the visitor to the first location
+    legs: list[int] = []
@@ -0,0 +1,41 @@
+import asyncio
+
+
+class TaskGraph:
+    """A tiny async dependency graph.
+
+    Every step is an async callable that receives the results of the steps it
+    depends on as keyword arguments. Steps whose dependencies are satisfied run
+    concurrently, so the total latency is roughly that of the longest branch.
+    """
+
+    def __init__(self):
+        self.steps = {}
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"step '{name}' depends on unknown step '{dep}'")
+        self.steps[name] = (fn, tuple(deps))
+        return self
+
+    async def run(self):
+        tasks = {}
+
+        async def run_step(name):
+            fn, deps = self.steps[name]
+            values = await asyncio.gather(*(tasks[dep] for dep in deps))
+            return await fn(**dict(zip(deps, values)))
+
+        # steps are added in dependency order, so every dependency task exists
+        # by the time the step that needs it is scheduled
+        for name in self.steps:
+            tasks[name] = asyncio.ensure_future(run_step(name))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,309 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from geo import geohash_encode, geohashes_in_radius, haversine
+from poi_store import POI
+
+
+class Tile:
+    """POIs of one geohash cell for one set of query parameters."""
+
+    def __init__(self, pois=None, updated_at=None):
+        self.pois = pois if pois is not None else {}
+        self.updated_at = updated_at or time.time()
+
+
+class Area:
+    """A circle around a search point inside which the upstream result was complete."""
+
+    def __init__(self, latitude, longitude, radius, fetched_at=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.fetched_at = fetched_at or time.time()
+
+
+class TileCache:
+    """Geohash-tiled cache of AMap POIs that answers radius queries by merging tiles.
+
+    POIs of every upstream `place/around` result are stored in the geohash cells
+    they fall in, and the searched circle is remembered as a covered area. A
+    query is answered from the merged tiles when the circle holding its nearest
+    results lies inside one covered area, or when the visitor has only drifted a
+    few steps from a previous search point.
+    """
+
+    def __init__(self, ttl=6 * 3600, max_tiles=20000, max_drift=250, precision=6, path=None):
+        self.ttl = ttl
+        self.max_tiles = max_tiles
+        self.max_drift = max_drift
+        self.precision = precision
+        # 覆盖区域按中心点所在的粗粒度geohash索引
+        self.area_precision = max(precision - 2, 1)
+        self.tiles = OrderedDict()
+        self.areas = {}
+        self.db = TileDB(path) if path else None
+        # the persistent layer is used from worker threads
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=int(os.getenv("POI_CACHE_TTL_SECONDS", 6 * 3600)),
+            max_tiles=int(os.getenv("POI_CACHE_MAX_TILES", 20000)),
+            max_drift=float(os.getenv("POI_CACHE_MAX_DRIFT_METERS", 250)),
+            path=os.getenv("POI_CACHE_DB_PATH") or None,
+        )
+
+    @property
+    def persistent(self):
+        return self.db is not None
+
+    def preload(self):
+        """Load the fresh tiles and areas of the persistent layer into memory, e.g. while warming up."""
+        if self.db is None:
+            return 0
+        since = time.time() - self.ttl
+        with self.lock:
+            # what expired while the service was down is dropped rather than loaded
+            self.db.evict(since)
+            for key, tile in self.db.recent_tiles(since, self.max_tiles):
+                self.tiles.setdefault(key, tile)
+            # every fresh area of a cell is loaded, so areas_near doesn't go back to the database for it
+            for key, area in self.db.recent_areas(since):
+                self.areas.setdefault(key, []).append(area)
+        return len(self.tiles)
+
+    def fresh(self, timestamp):
+        return time.time() - timestamp <= self.ttl
+
+    def tile(self, key):
+        tile = self.tiles.get(key)
+        if tile is None and self.db is not None:
+            tile = self.db.get_tile(key)
+            if tile is not None:
+                self.remember(key, tile)
+        if tile is None:
+            return None
+        if not self.fresh(tile.updated_at):
+            self.tiles.pop(key, None)
+            return None
+        self.tiles.move_to_end(key)
+        return tile
+
+    def remember(self, key, tile):
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+    def areas_near(self, lat, lon, radius, params):
+        areas = []
+        for cell in geohashes_in_radius(lat, lon, radius, self.area_precision):
+            key = (params, cell)
+            if key not in self.areas and self.db is not None:
+                self.areas[key] = self.db.get_areas(key)
+            live = [area for area in self.areas.get(key, []) if self.fresh(area.fetched_at)]
+            if live:
+                self.areas[key] = live
+            else:
+                self.areas.pop(key, None)
+            areas.extend(live)
+        return areas
+
+    def version(self, lat, lon, params):
+        """When the latest search covering a point was stored, 0 when none does.
+
+        It changes whenever the POIs the cache answers with around the point may have.
+        """
+        with self.lock:
+            return max(
+                (area.fetched_at for area in self.areas_near(lat, lon, 0, params)
+                 if haversine(lat, lon, area.latitude, area.longitude) <= area.radius),
+                default=0,
+            )
+
+    def candidates(self, lat, lon, radius, params, origin=None):
+        """Cached POIs within `radius` metres of a point, sorted by distance to `origin`.
+
+        Returns None when one of the cells is missing.
+        """
+        origin = origin or (lat, lon)
+        candidates = []
+        for cell in geohashes_in_radius(lat, lon, radius, self.precision):
+            tile = self.tile((params, cell))
+            if tile is None:
+                return None
+            for poi in tile.pois.values():
+                if haversine(lat, lon, poi.latitude, poi.longitude) <= radius:
+                    candidates.append((haversine(*origin, poi.latitude, poi.longitude), poi))
+        candidates.sort(key=lambda item: item[0])
+        return candidates
+
+    def query(self, lat, lon, radius, params, limit):
+        """Nearest `limit` POIs within `radius` metres, or None when the cache can't tell."""
+        with self.lock:
+            result = self.lookup(lat, lon, radius, params, limit)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def lookup(self, lat, lon, radius, params, limit):
+        areas = []
+        for area in self.areas_near(lat, lon, radius, params):
+            drift = haversine(lat, lon, area.latitude, area.longitude)
+            if drift <= area.radius:
+                areas.append((drift, area))
+        if not areas:
+            return None
+
+        # every POI within the largest covered circle around the visitor is known,
+        # so if it holds enough of them the answer is exact
+        complete = min(radius, max(area.radius - drift for drift, area in areas))
+        candidates = self.candidates(lat, lon, complete, params)
+        if candidates is not None and (len(candidates) >= limit or complete >= radius):
+            return [poi for _, poi in candidates[:limit]]
+
+        # a visitor who has barely moved gets the neighbourhood of the previous
+        # search re-ranked by distance
+        drift, area = min(areas, key=lambda item: item[0])
+        if drift > self.max_drift:
+            return None
+        candidates = self.candidates(area.latitude, area.longitude, area.radius, params, origin=(lat, lon))
+        if candidates is None:
+            return None
+        return [poi for distance, poi in candidates if distance <= radius][:limit]
+
+    def store(self, lat, lon, radius, params, pois):
+        """Record the POIs returned by a search around a point.
+
+        `radius` should be the radius the result is complete for: the search
+        radius when every match was returned, otherwise the distance of the
+        farthest POI of a distance-sorted, truncated result.
+        """
+        with self.lock:
+            self.insert(lat, lon, radius, params, pois)
+
+    def insert(self, lat, lon, radius, params, pois):
+        now = time.time()
+        by_cell = {}
+        for poi in pois:
+            cell = geohash_encode(poi.latitude, poi.longitude, self.precision)
+            by_cell.setdefault(cell, {})[poi.id] = poi
+
+        # cells the search saw get a tile even when empty, so a missing tile
+        # always means "unknown" rather than "no POIs"
+        for cell in geohashes_in_radius(lat, lon, radius, self.precision) | set(by_cell):
+            key = (params, cell)
+            tile = self.tile(key) or Tile()
+            tile.pois.update(by_cell.get(cell, {}))
+            tile.updated_at = now
+            self.remember(key, tile)
+            if self.db is not None:
+                self.db.put_tile(key, tile)
+
+        area = Area(lat, lon, radius, fetched_at=now)
+        key = (params, geohash_encode(lat, lon, self.area_precision))
+        self.areas_near(lat, lon, 0, params)
+        self.areas.setdefault(key, []).append(area)
+        if self.db is not None:
+            self.db.put_area(key, area)
+            # expired rows are purged every so often rather than on every write
+            if self.db.writes % 100 == 0:
+                self.db.evict(now - self.ttl)
+
+
+class TileDB:
+    """SQLite persistence for tiles and areas, shared by worker processes and restarts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                "params TEXT NOT NULL, geohash TEXT NOT NULL, pois TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (params, geohash))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS areas ("
+                "params TEXT NOT NULL, geohash TEXT NOT NULL, latitude REAL NOT NULL, "
+                "longitude REAL NOT NULL, radius REAL NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS areas_cell ON areas (params, geohash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS areas_fetched_at ON areas (fetched_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_updated_at ON tiles (updated_at)")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self.local.conn = conn
+        return conn
+
+    def get_tile(self, key):
+        row = self.connection().execute(
+            "SELECT pois, updated_at FROM tiles WHERE params = ? AND geohash = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        return self.load_tile(*row)
+
+    def load_tile(self, pois, updated_at):
+        pois = {poi_id: POI.from_dict(poi) for poi_id, poi in json.loads(pois).items()}
+        return Tile(pois, updated_at=updated_at)
+
+    def recent_tiles(self, since, limit):
+        """Up to `limit` tiles updated after `since`, oldest first."""
+        rows = self.connection().execute(
+            "SELECT params, geohash, pois, updated_at FROM tiles WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?",
+            (since, limit),
+        ).fetchall()
+        return [((params, geohash), self.load_tile(pois, updated_at)) for params, geohash, pois, updated_at in reversed(rows)]
+
+    def recent_areas(self, since):
+        rows = self.connection().execute(
+            "SELECT params, geohash, latitude, longitude, radius, fetched_at FROM areas WHERE fetched_at >= ?", (since,)
+        ).fetchall()
+        return [((params, geohash), Area(*row)) for params, geohash, *row in rows]
+
+    def put_tile(self, key, tile):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles (params, geohash, pois, updated_at) VALUES (?, ?, ?, ?)",
+                (*key, json.dumps({poi_id: poi.to_dict() for poi_id, poi in tile.pois.items()}, ensure_ascii=False), tile.updated_at),
+            )
+
+    def get_areas(self, key):
+        rows = self.connection().execute(
+            "SELECT latitude, longitude, radius, fetched_at FROM areas WHERE params = ? AND geohash = ?", key
+        ).fetchall()
+        return [Area(*row) for row in rows]
+
+    def put_area(self, key, area):
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO areas (params, geohash, latitude, longitude, radius, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, area.latitude, area.longitude, area.radius, area.fetched_at),
+            )
+        self.writes += 1
+
+    def evict(self, since):
+        """Delete the areas fetched before `since` and the tiles no remaining area covers.
+
+        Every search refreshes the tiles of the circle it covered, so a tile
+        last updated before `since` lies outside every area still kept.
+        """
+        with self.connection() as conn:
+            conn.execute("DELETE FROM areas WHERE fetched_at < ?", (since,))
+            conn.execute("DELETE FROM tiles WHERE updated_at < ?", (since,))
@@ -0,0 +1,100 @@
+import math
+import os
+
+import numpy as np
+
+from amap import load_amap_dumps
+from geo import EARTH_RADIUS, radius_bbox
+from landmarks import score, typecode_weight
+from poi_store import POIColumns
+
+
+def haversine_many(lat, lon, lats, lons):
+    """Vectorized distance in metres from one point to arrays of points."""
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lons - lon)
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+class POIIndex:
+    """In-memory spatial index over POIs from the AMap dumps.
+
+    POIs are held in columns (see POIColumns) and bucketed on a regular lat/lon
+    grid, so a radius query only computes distances for the POIs of the few
+    cells around the visitor, and only builds records for the ones it returns.
+    """
+
+    def __init__(self, pois, cell_size=0.02):
+        # 同一个POI可能出现在多个dump里，按id去重
+        unique = {}
+        for poi in pois:
+            unique.setdefault(poi.id, poi)
+        self.columns = POIColumns(list(unique.values()))
+        self.cell_size = cell_size
+        self.lats = self.columns.lats
+        self.lons = self.columns.lons
+        self.ratings = self.columns.ratings
+        # weight of each distinct type code, looked up by the rows' type code ids
+        self.typecode_weights = np.array([typecode_weight(code) for code in self.columns.typecodes], dtype=np.float32)
+
+        cells = {}
+        rows = np.floor(self.lats / cell_size).astype(np.int64)
+        cols = np.floor(self.lons / cell_size).astype(np.int64)
+        for i, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            cells.setdefault(cell, []).append(i)
+        self.cells = {cell: np.array(indices, dtype=np.int64) for cell, indices in cells.items()}
+
+    @classmethod
+    def from_dumps(cls, directory="."):
+        return cls(load_amap_dumps(directory))
+
+    @classmethod
+    def from_env(cls):
+        return cls.from_dumps(os.getenv("POI_INDEX_DIR") or os.path.dirname(os.path.abspath(__file__)))
+
+    def __len__(self):
+        return len(self.columns)
+
+    def candidates(self, lat, lon, radius):
+        lat_min, lat_max, lon_min, lon_max = radius_bbox(lat, lon, radius)
+        row_min, row_max = math.floor(lat_min / self.cell_size), math.floor(lat_max / self.cell_size)
+        col_min, col_max = math.floor(lon_min / self.cell_size), math.floor(lon_max / self.cell_size)
+        found = [
+            self.cells[(row, col)]
+            for row in range(row_min, row_max + 1)
+            for col in range(col_min, col_max + 1)
+            if (row, col) in self.cells
+        ]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found) if len(found) > 1 else found[0]
+
+    def query(self, lat, lon, radius, k=20, **weights):
+        """Top `k` POIs within `radius` metres, ranked like AMap results (see landmarks.score).
+
+        `weights` override the weights of the score, e.g. rating_weight=0,
+        category_weight=0 ranks by distance only.
+        """
+        indices = self.candidates(lat, lon, radius)
+        if len(indices) == 0:
+            return []
+        # float32 columns, but the distances of the few candidates in float64
+        distances = haversine_many(
+            lat, lon, self.lats[indices].astype(np.float64), self.lons[indices].astype(np.float64)
+        )
+        inside = distances <= radius
+        indices, distances = indices[inside], distances[inside]
+        if len(indices) == 0:
+            return []
+
+        categories = self.typecode_weights[self.columns.typecode_ids[indices]]
+        scores = score(self.ratings[indices], distances, categories, radius, **weights)
+        if len(indices) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(indices))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self.columns.records(indices[top])
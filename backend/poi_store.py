@@ -0,0 +1,90 @@
+import sys
+
+import numpy as np
+
+
+def format_rating(rating):
+    # 4.2 -> "4.2", 4.0 -> "4.0", 没有评分 -> "0"，与高德返回的格式一致
+    return f"{rating:.1f}" if rating else "0"
+
+
+class POI:
+    """One AMap POI, holding only the fields the guide uses.
+
+    Names and type codes are interned, so the same POI held by the tile
+    cache, the geocoder and the local index shares its strings.
+    """
+
+    __slots__ = ("id", "name", "latitude", "longitude", "rating", "typecode")
+
+    def __init__(self, id, name, latitude, longitude, rating=0.0, typecode=""):
+        self.id = id
+        self.name = sys.intern(name)
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.rating = float(rating)
+        self.typecode = sys.intern(typecode)
+
+    def to_location(self):
+        """Plain dict in the shape of the `Location` API model."""
+        return {
+            "latitude": str(self.latitude),
+            "longitude": str(self.longitude),
+            "displayName": self.name,
+            "rating": format_rating(self.rating),
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "rating": self.rating,
+            "typecode": self.typecode,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def __repr__(self):
+        return f"POI({self.id!r}, {self.name!r}, {self.latitude}, {self.longitude}, rating={self.rating})"
+
+
+class POIColumns:
+    """A whole city of POIs in arrays: float32 coordinates and ratings,
+    interned names and type codes stored as indexes into a table.
+
+    Records are only built for the rows a query returns.
+    """
+
+    def __init__(self, pois):
+        self.ids = [poi.id for poi in pois]
+        self.names = [sys.intern(poi.name) for poi in pois]
+        self.lats = np.array([poi.latitude for poi in pois], dtype=np.float32)
+        self.lons = np.array([poi.longitude for poi in pois], dtype=np.float32)
+        self.ratings = np.array([poi.rating for poi in pois], dtype=np.float32)
+        codes = {}
+        self.typecode_ids = np.array(
+            [codes.setdefault(poi.typecode, len(codes)) for poi in pois], dtype=np.uint16
+        )
+        self.typecodes = list(codes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.records([i])[0]
+
+    def records(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        # float32 keeps about a metre of precision, round away the float noise
+        lats = np.round(self.lats[indices].astype(np.float64), 6).tolist()
+        lons = np.round(self.lons[indices].astype(np.float64), 6).tolist()
+        ratings = np.round(self.ratings[indices].astype(np.float64), 1).tolist()
+        codes = self.typecode_ids[indices].tolist()
+        return [
+            POI(self.ids[i], self.names[i], lat, lon, rating, self.typecodes[code])
+            for i, lat, lon, rating, code in zip(indices.tolist(), lats, lons, ratings, codes)
+        ]
@@ -0,0 +1,66 @@
+import asyncio
+
+import tracing
+from metrics import current_request
+
+
+class PreferenceUpdater:
+    """Infers visitor preferences in the background, off the response path.
+
+    There is at most one update in flight per session. Turns that arrive while
+    an update is running are picked up by one follow-up pass, and every pass
+    only sends the newest turns together with the preferences inferred so far.
+    """
+
+    def __init__(self, agent, sessions):
+        self.agent = agent
+        self.sessions = sessions
+        self.tasks = {}
+        self.pending = set()
+
+    def schedule(self, session_id):
+        if session_id in self.tasks:
+            self.pending.add(session_id)
+            return
+        task = asyncio.create_task(self.run(session_id))
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(session_id, None))
+
+    async def run(self, session_id):
+        # the task was created while serving a request, its spans are not part of that request
+        current_request.set(None)
+        while True:
+            self.pending.discard(session_id)
+            try:
+                await self.update(session_id)
+            except Exception as e:
+                tracing.log("error", stage="preferences", session_id=session_id, error=str(e))
+            if session_id not in self.pending:
+                return
+
+    async def update(self, session_id):
+        session = await self.sessions.get(session_id)
+        # the session expired or was evicted meanwhile
+        if session is None:
+            return
+        preferences = session.preferences
+        upto = session.conversation.count
+        new_turns = session.conversation.turns_since(session.preferences_turns)
+        if not new_turns:
+            return
+
+        # the session lock is not held during the LLM call, so the visitor's
+        # next turn never waits for it
+        preferences = await self.agent.infer_user_preferences(preferences, new_turns)
+
+        async with self.sessions.session(session_id, create=False) as session:
+            # the session is gone, or the conversation was reset while we were busy
+            if session is None or session.conversation.count < upto:
+                return
+            session.preferences = preferences
+            session.preferences_turns = upto
+
+    async def drain(self):
+        """Wait for the updates in flight, e.g. on shutdown."""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks.values()), return_exceptions=True)
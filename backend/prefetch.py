@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import tracing
+from geo import geohash_encode
+from metrics import current_request
+
+
+class Prefetcher:
+    """Warms the landmarks and Wikipedia context of where the map is.
+
+    The frontend reports the map centre whenever the map comes to rest, long
+    before the visitor has finished speaking. Each area (a ~150 m geohash
+    cell) is warmed at most once per `warm_ttl`, and one warm-up is shared by
+    every client looking at the same area. A client moving on to another area
+    withdraws from the previous one, which is cancelled, along with its
+    upstream calls, once nobody is interested in it any more. Clients are
+    limited to one new area every `min_interval` seconds.
+    """
+
+    def __init__(self, agent, min_interval=1.0, warm_ttl=300, wiki_landmarks=3, precision=7,
+                 max_clients=10000):
+        self.agent = agent
+        self.min_interval = min_interval
+        self.warm_ttl = warm_ttl
+        self.wiki_landmarks = wiki_landmarks
+        self.precision = precision
+        self.max_clients = max_clients
+        # client -> (cell, when it last started a prefetch)
+        self.clients = OrderedDict()
+        self.tasks = {}
+        self.interested = {}
+        self.warmed = OrderedDict()
+        self.counts = dict.fromkeys(("scheduled", "joined", "duplicate", "warm", "throttled", "cancelled", "completed"), 0)
+
+    @classmethod
+    def from_env(cls, agent):
+        return cls(
+            agent,
+            min_interval=float(os.getenv("PREFETCH_MIN_INTERVAL_SECONDS", 1.0)),
+            warm_ttl=int(os.getenv("PREFETCH_WARM_TTL_SECONDS", 300)),
+            wiki_landmarks=int(os.getenv("PREFETCH_WIKI_LANDMARKS", 3)),
+        )
+
+    def schedule(self, client, city):
+        """Start warming the area around `city` for `client`; returns what was done."""
+        now = time.monotonic()
+        cell = geohash_encode(float(city["latitude"]), float(city["longitude"]), self.precision)
+        previous = self.clients.get(client)
+        if previous is not None and previous[0] == cell:
+            return self.count("duplicate")
+        if previous is not None and now - previous[1] < self.min_interval:
+            return self.count("throttled")
+
+        self.leave(client)
+        self.clients[client] = (cell, now)
+        self.clients.move_to_end(client)
+        while len(self.clients) > self.max_clients:
+            self.leave(next(iter(self.clients)))
+
+        warmed = self.warmed.get(cell)
+        if warmed is not None and now - warmed <= self.warm_ttl:
+            return self.count("warm")
+        self.interested.setdefault(cell, set()).add(client)
+        if cell in self.tasks:
+            return self.count("joined")
+
+        task = asyncio.create_task(self.warm(cell, city))
+        self.tasks[cell] = task
+        task.add_done_callback(lambda _: self.done(cell, task))
+        return self.count("scheduled")
+
+    def count(self, status):
+        self.counts[status] += 1
+        return status
+
+    def leave(self, client):
+        """Withdraw a client from its area, cancelling the warm-up if it was the last one."""
+        previous = self.clients.pop(client, None)
+        if previous is None:
+            return
+        cell = previous[0]
+        clients = self.interested.get(cell)
+        if clients is None:
+            return
+        clients.discard(client)
+        if not clients and cell in self.tasks:
+            self.tasks[cell].cancel()
+
+    async def warm(self, cell, city):
+        # started by a request, but not part of it
+        current_request.set(None)
+        landmarks = await self.agent.get_nearby_landmarks(city)
+        # the places the visitor is most likely to ask about
+        names = [poi.name for poi in landmarks[:self.wiki_landmarks]]
+        await asyncio.gather(*(self.agent.get_wikipedia_article(name) for name in names))
+
+    def done(self, cell, task):
+        self.tasks.pop(cell, None)
+        self.interested.pop(cell, None)
+        if task.cancelled():
+            self.counts["cancelled"] += 1
+            return
+        if task.exception() is not None:
+            error = task.exception()
+            tracing.log("error", stage="prefetch", cell=cell, error=str(error) or type(error).__name__)
+            return
+        self.counts["completed"] += 1
+        self.warmed[cell] = time.monotonic()
+        self.warmed.move_to_end(cell)
+        while len(self.warmed) > self.max_clients:
+            self.warmed.popitem(last=False)
+
+    def cancel(self):
+        """Stop the warm-ups in flight, e.g. on shutdown."""
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+    def stats(self):
+        return dict(self.counts, in_flight=len(self.tasks))
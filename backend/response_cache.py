@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from geo import geohash_encode
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_query(query):
+    return " ".join(PUNCTUATION.sub(" ", query.lower()).split())
+
+
+class ResponseCache:
+    """LRU cache of agent answers for turns that don't depend on the history.
+
+    Keys combine the normalized query, a coarse geohash tile of the visitor's
+    position, the reply language and what else the answer was built from:
+
+    - opening questions: the version of the landmarks around the visitor.
+      Everything is known before the first LLM call, so a hit skips the
+      classifier and the landmark and Wikipedia lookups too.
+    - questions about a place: the place the classifier resolved and the
+      nearby landmark names, so "tell me more about it" is only shared by
+      visitors asking about the same place.
+    """
+
+    def __init__(self, ttl=900, max_entries=2000, precision=6, enabled=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 900)),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000)),
+            enabled=os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+        )
+
+    def key(self, query, latitude, longitude, language, *context):
+        raw = json.dumps(
+            [normalize_query(query), geohash_encode(latitude, longitude, self.precision), language.lower(), *context],
+            ensure_ascii=False,
+        )
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, response):
+        self.entries[key] = (time.time(), response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,98 @@
+import numpy as np
+
+from geo import EARTH_RADIUS
+
+# an improvement has to beat this many metres, so float noise can't loop forever
+EPSILON = 1e-6
+
+
+def distance_matrix(lats, lons):
+    """Pairwise great-circle distances in metres, vectorized."""
+    phi = np.radians(np.asarray(lats, dtype=np.float64))
+    lam = np.radians(np.asarray(lons, dtype=np.float64))
+    dphi = phi[:, None] - phi[None, :]
+    dlambda = lam[:, None] - lam[None, :]
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def nearest_neighbour(dist):
+    n = len(dist)
+    path = [0]
+    left = np.ones(n, dtype=bool)
+    left[0] = False
+    while left.any():
+        row = np.where(left, dist[path[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        path.append(nxt)
+        left[nxt] = False
+    return np.array(path)
+
+
+def two_opt(path, dist):
+    """Reverse stretches of the path while that shortens it; both ends stay put."""
+    n = len(path)
+    improved = False
+    for i in range(1, n - 2):
+        # all j at once: reverse path[i..j]
+        js = np.arange(i + 1, n - 1)
+        a, b = path[i - 1], path[i]
+        c, d = path[js], path[js + 1]
+        delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+        best = int(np.argmin(delta))
+        if delta[best] < -EPSILON:
+            j = js[best]
+            path[i:j + 1] = path[i:j + 1][::-1]
+            improved = True
+    return improved
+
+
+def or_opt(path, dist, max_segment=3):
+    """Move short runs of stops, possibly reversed, to where they fit best."""
+    n = len(path)
+    improved = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length < n:
+            a, s0, s1, b = path[i - 1], path[i], path[i + length - 1], path[i + length]
+            removed = dist[a, s0] + dist[s1, b] - dist[a, b]
+            rest = np.concatenate([path[:i], path[i + length:]])
+            # insert between rest[k] and rest[k + 1]
+            p, q = rest[:-1], rest[1:]
+            forward = dist[p, s0] + dist[s1, q] - dist[p, q]
+            backward = dist[p, s1] + dist[s0, q] - dist[p, q]
+            added = np.minimum(forward, backward)
+            k = int(np.argmin(added))
+            if added[k] - removed < -EPSILON:
+                segment = path[i:i + length]
+                if backward[k] < forward[k]:
+                    segment = segment[::-1]
+                path[:] = np.concatenate([rest[:k + 1], segment, rest[k + 1:]])
+                improved = True
+            i += 1
+    return improved
+
+
+def order_stops(start, stops, max_passes=50):
+    """Visiting order of `stops` ((lat, lon) pairs) for a walk from `start`.
+
+    The walk ends wherever is shortest, it doesn't return to the start.
+    Returns the order as indices into `stops` and the length of every leg in
+    metres, the first leg being the one from the start.
+    """
+    if not stops:
+        return [], []
+    points = [start] + list(stops)
+    dist = np.zeros((len(points) + 1, len(points) + 1))
+    dist[:-1, :-1] = distance_matrix([p[0] for p in points], [p[1] for p in points])
+    # a dummy last node, free to reach from anywhere, turns the open walk into
+    # a path with both ends fixed
+    path = np.append(nearest_neighbour(dist[:-1, :-1]), len(points))
+
+    for _ in range(max_passes):
+        if not (two_opt(path, dist) | or_opt(path, dist)):
+            break
+
+    visits = path[1:-1]
+    legs = [float(dist[a, b]) for a, b in zip(path[:-2], path[1:-1])]
+    return [int(node) - 1 for node in visits], legs
@@ -0,0 +1,303 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import orjson
+
+from history import ConversationHistory
+
+
+class SessionConflict(Exception):
+    """Another worker saved the session since it was loaded."""
+
+
+class Session:
+    """Conversation state of one visitor."""
+
+    def __init__(self, session_id, language="English", conversation=None, preferences=None,
+                 preferences_turns=0, updated_at=None):
+        self.session_id = session_id
+        self.language = language
+        self.conversation = conversation if conversation is not None else ConversationHistory()
+        self.preferences = preferences
+        # how many turns of the conversation the preferences already reflect
+        self.preferences_turns = preferences_turns
+        self.updated_at = updated_at or time.time()
+        # row version in a shared store, 0 when the session isn't stored yet
+        self.version = 0
+
+    def reset(self):
+        self.language = "English"
+        self.conversation = ConversationHistory()
+        self.preferences = None
+        self.preferences_turns = 0
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "language": self.language,
+            "conversation": self.conversation.to_dict(),
+            "preferences": self.preferences,
+            "preferences_turns": self.preferences_turns,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data, conversation=ConversationHistory.from_dict(data["conversation"]))
+        return cls(**data)
+
+    def dumps(self):
+        # the conversation brings its turns already encoded, only the few other fields are encoded here
+        fields = orjson.dumps({
+            "session_id": self.session_id,
+            "language": self.language,
+            "preferences": self.preferences,
+            "preferences_turns": self.preferences_turns,
+            "updated_at": self.updated_at,
+        })
+        return (fields[:-1] + b',"conversation":' + self.conversation.encode() + b"}").decode("utf-8")
+
+    @classmethod
+    def loads(cls, raw):
+        return cls.from_dict(orjson.loads(raw))
+
+    def nbytes(self):
+        """Approximate size of `dumps()`, kept up to date as the conversation grows."""
+        return self.conversation.nbytes() + len(self.session_id) + len(str(self.preferences)) + 200
+
+
+class MemorySessionStore:
+    """In-process LRU of sessions with idle-TTL and a memory budget.
+
+    The size of a session is estimated from its serialized form, which is a
+    good proxy for the memory held by the conversation history. The history
+    tracks that size as turns are appended, so a put doesn't serialize.
+    """
+
+    def __init__(self, ttl=3600, max_sessions=10000, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session.updated_at > self.ttl:
+            self.delete(session_id)
+            return None
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def put(self, session):
+        session.updated_at = time.time()
+        size = session.nbytes()
+        self.total_bytes += size - self.sizes.get(session.session_id, 0)
+        self.sizes[session.session_id] = size
+        self.sessions[session.session_id] = session
+        self.sessions.move_to_end(session.session_id)
+        self.evict()
+
+    def delete(self, session_id):
+        if self.sessions.pop(session_id, None) is not None:
+            self.total_bytes -= self.sizes.pop(session_id)
+
+    def evict(self):
+        now = time.time()
+        # least recently used sessions sit at the front, so expired ones do too
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            over_budget = len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+            if not over_budget and now - session.updated_at <= self.ttl:
+                break
+            self.delete(session_id)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SQLiteSessionStore:
+    """Sessions persisted in SQLite so several worker processes can share them.
+
+    A turn holds a lease on its session (see acquire) from load to save, so
+    workers take turns on the same session instead of overwriting each
+    other's. Saves are also checked against the version that was loaded: a
+    save that would overwrite a newer one, e.g. after a lease ran out, raises
+    SessionConflict instead of losing a turn.
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.writes = 0
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 1)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            # databases created before sessions were versioned, their rows become version 1
+            if "version" not in [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]:
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_leases ("
+                "session_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self.local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self.connection().execute(
+            "SELECT data, updated_at, version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.delete(session_id)
+            return None
+        session = Session.loads(row[0])
+        session.version = row[2]
+        return session
+
+    def put(self, session):
+        session.updated_at = time.time()
+        with self.connection() as conn:
+            if session.version:
+                saved = conn.execute(
+                    "UPDATE sessions SET data = ?, updated_at = ?, version = version + 1 "
+                    "WHERE session_id = ? AND version = ?",
+                    (session.dumps(), session.updated_at, session.session_id, session.version),
+                ).rowcount
+            else:
+                saved = conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, data, updated_at, version) VALUES (?, ?, ?, 1)",
+                    (session.session_id, session.dumps(), session.updated_at),
+                ).rowcount
+        if not saved:
+            raise SessionConflict(session.session_id)
+        session.version += 1
+        # expired rows are purged every so often rather than on every write
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.evict()
+
+    def delete(self, session_id):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def evict(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            # leases of workers that died holding them
+            conn.execute("DELETE FROM session_leases WHERE expires_at < ?", (time.time(),))
+
+    def acquire(self, session_id, owner, lease):
+        """Take the session for `lease` seconds; False while another owner's lease runs."""
+        now = time.time()
+        with self.connection() as conn:
+            return conn.execute(
+                "INSERT INTO session_leases (session_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE session_leases.expires_at < ?",
+                (session_id, owner, now + lease, now),
+            ).rowcount == 1
+
+    def release(self, session_id, owner):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM session_leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+
+class SessionManager:
+    """Hands out sessions by ID and serializes turns within one session.
+
+    Within a process an asyncio lock per session does; a store shared between
+    worker processes is leased on top of it.
+    """
+
+    def __init__(self, store, lease=120, poll_interval=0.05):
+        self.store = store
+        self.blocking = isinstance(store, SQLiteSessionStore)
+        self.locks = weakref.WeakValueDictionary()
+        # how long a turn may hold a shared session before other workers may take it
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_env(cls):
+        ttl = int(os.getenv("SESSION_TTL_SECONDS", 3600))
+        if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+            store = SQLiteSessionStore(os.getenv("SESSION_DB_PATH", "sessions.db"), ttl=ttl)
+            return cls(store, lease=float(os.getenv("SESSION_LEASE_SECONDS", 120)))
+        store = MemorySessionStore(
+            ttl=ttl,
+            max_sessions=int(os.getenv("SESSION_MAX_COUNT", 10000)),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", 64 * 1024 * 1024)),
+        )
+        return cls(store)
+
+    async def call(self, fn, *args):
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def lock(self, session_id):
+        lock = self.locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[session_id] = lock
+        return lock
+
+    @asynccontextmanager
+    async def leased(self, session_id):
+        """Hold the session against the other worker processes, for stores shared between them."""
+        if not self.blocking:
+            yield
+            return
+        owner = uuid.uuid4().hex
+        while not await self.call(self.store.acquire, session_id, owner, self.lease):
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            await self.call(self.store.release, session_id, owner)
+
+    async def get(self, session_id):
+        """A session to read from, or None; it isn't saved back."""
+        return await self.call(self.store.get, session_id)
+
+    @asynccontextmanager
+    async def session(self, session_id, reset=False, create=True):
+        """Load (or create) a session, and save it back when the turn is done.
+
+        With create=False a missing session is yielded as None and nothing is saved.
+        """
+        async with self.lock(session_id), self.leased(session_id):
+            session = await self.call(self.store.get, session_id)
+            if session is None:
+                if not create:
+                    yield None
+                    return
+                session = Session(session_id)
+            elif reset:
+                session.reset()
+            yield session
+            await self.call(self.store.put, session)
@@ -0,0 +1,60 @@
+import asyncio
+from collections import Counter
+
+
+class SingleFlight:
+    """Concurrent identical upstream calls share one in-flight call.
+
+    The first caller for a key starts the call; everyone asking for the same
+    key while it runs waits for that call and gets its result (or its error).
+    The call is cancelled once every caller waiting for it has been.
+    Nothing is kept once it finishes, longer-lived caching is up to the
+    caches. Keys are tuples whose first element names the kind of call, which
+    is how the counters are broken down.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.waiting = Counter()
+        self.started = Counter()
+        self.coalesced = Counter()
+
+    async def do(self, key, fn, *args):
+        task = self.calls.get(key)
+        if task is None:
+            self.started[key[0]] += 1
+            task = asyncio.ensure_future(fn(*args))
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.done(key, task))
+        else:
+            self.coalesced[key[0]] += 1
+        # a caller that gives up doesn't cancel the call for the others, only the last one does
+        self.waiting[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiting[task] -= 1
+            if not self.waiting[task]:
+                del self.waiting[task]
+                if not task.done():
+                    task.cancel()
+                    # callers arriving before the done callback runs start a fresh call
+                    self.forget(key, task)
+
+    def forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+    def done(self, key, task):
+        # a cancelled call may already have been replaced by a fresh one
+        self.forget(key, task)
+        # every waiter may have given up, don't let the error go unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        stats = {"in_flight": len(self.calls)}
+        for kind in self.started:
+            stats[f"{kind}_calls"] = self.started[kind]
+            stats[f"{kind}_coalesced"] = self.coalesced[kind]
+        return stats
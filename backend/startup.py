@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import tracing
+
+
+class Startup:
+    """Brings the service up in the background and tells when it is warm.
+
+    The server listens as soon as the app module is imported, so liveness
+    probes pass right away while the warm-up steps run; readiness only turns
+    on once they have all finished. Every step is timed, and the time from
+    process start to ready is reported.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.steps = {}
+        self.ready = asyncio.Event()
+        # set when the warm-up is over, whether it succeeded or not
+        self.done = asyncio.Event()
+        self.error = None
+        self.seconds = None
+        self.task = None
+
+    def start(self, warm_up):
+        self.task = asyncio.create_task(self.run(warm_up))
+
+    async def run(self, warm_up):
+        try:
+            await warm_up(self)
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            tracing.log("error", stage="startup", error=self.error, steps=self.steps)
+        else:
+            self.seconds = time.perf_counter() - self.started
+            self.ready.set()
+            tracing.log("startup", seconds=self.seconds, steps=self.steps)
+        finally:
+            self.done.set()
+
+    async def step(self, name, fn, *args):
+        """Run one warm-up step, blocking ones in a worker thread, and time it."""
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                return await fn(*args)
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+    async def wait(self, timeout):
+        """Wait until warm; False when the warm-up failed or took longer than `timeout`."""
+        if not self.done.is_set():
+            try:
+                await asyncio.wait_for(self.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.ready.is_set()
+
+    def status(self):
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "startup_seconds": self.seconds,
+            "uptime_seconds": time.perf_counter() - self.started,
+            "steps": self.steps,
+        }
+
+    def stats(self):
+        stats = {"ready": float(self.ready.is_set())}
+        if self.seconds is not None:
+            stats["seconds"] = self.seconds
+        stats.update({f"{name}_seconds": seconds for name, seconds in self.steps.items()})
+        return stats
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
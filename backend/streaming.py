@@ -0,0 +1,123 @@
+import json
+
+# marks the closing quote of a string
+END = object()
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class Container:
+    def __init__(self, kind):
+        self.kind = kind
+        self.key = None
+        self.expect_key = kind == "object"
+
+
+class ResponseStreamParser:
+    """Incremental parser for the streamed `CityWalkResponse` JSON.
+
+    Fed the raw completion deltas, it yields ("speech", text) as soon as
+    characters of the top-level speech string arrive, and ("location", item)
+    for every item of the top-level locations list once the item is complete.
+    """
+
+    def __init__(self, text_field="speech", list_field="locations"):
+        self.text_field = text_field
+        self.list_field = list_field
+        self.stack = []
+        self.in_string = False
+        self.string_role = None
+        self.string = []
+        self.escape = None
+        self.high_surrogate = None
+        self.item = None
+
+    def in_list(self):
+        return (
+            len(self.stack) == 2
+            and self.stack[1].kind == "array"
+            and self.stack[0].key == self.list_field
+        )
+
+    def feed(self, chunk):
+        events = []
+        for char in chunk:
+            if self.item is not None:
+                self.item.append(char)
+            if self.in_string:
+                decoded = self.read_string_char(char)
+                if decoded is None:
+                    continue
+                if decoded is END:
+                    self.end_string(events)
+                elif self.string_role == "speech":
+                    # consecutive speech characters are sent as one event
+                    if events and events[-1][0] == "speech":
+                        events[-1] = ("speech", events[-1][1] + decoded)
+                    else:
+                        events.append(("speech", decoded))
+                else:
+                    self.string.append(decoded)
+                continue
+
+            top = self.stack[-1] if self.stack else None
+            if char == '"':
+                self.in_string = True
+                self.string = []
+                if top is not None and top.kind == "object" and top.expect_key:
+                    self.string_role = "key"
+                elif len(self.stack) == 1 and top.key == self.text_field:
+                    self.string_role = "speech"
+                elif self.in_list():
+                    self.string_role = "item"
+                else:
+                    self.string_role = "value"
+            elif char in "{[":
+                if self.in_list() and char == "{":
+                    self.item = [char]
+                self.stack.append(Container("object" if char == "{" else "array"))
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if self.item is not None and self.in_list():
+                    events.append(("location", json.loads("".join(self.item))))
+                    self.item = None
+            elif char == ":" and top is not None:
+                top.expect_key = False
+            elif char == "," and top is not None and top.kind == "object":
+                top.expect_key = True
+        return events
+
+    def read_string_char(self, char):
+        """Decode one character of a JSON string, None while an escape is incomplete."""
+        if self.escape is not None:
+            self.escape += char
+            if self.escape[0] == "u":
+                if len(self.escape) < 5:
+                    return None
+                code = int(self.escape[1:], 16)
+                self.escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self.high_surrogate = code
+                    return None
+                if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                    code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                    self.high_surrogate = None
+                return chr(code)
+            decoded = ESCAPES.get(self.escape, self.escape)
+            self.escape = None
+            return decoded
+        if char == "\\":
+            self.escape = ""
+            return None
+        if char == '"':
+            return END
+        return char
+
+    def end_string(self, events):
+        self.in_string = False
+        value = "".join(self.string)
+        if self.string_role == "key":
+            self.stack[-1].key = value
+        elif self.string_role == "item":
+            events.append(("location", value))
+
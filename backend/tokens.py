@@ -0,0 +1,29 @@
+import re
+
+CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+
+def estimate_tokens(text):
+    """Rough token count without a tokenizer.
+
+    CJK characters are about one token each, everything else about four
+    characters per token, which is close enough for prompt budgeting.
+    """
+    if not text:
+        return 0
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_tokens(text, budget):
+    """Cut text down to roughly `budget` tokens."""
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
@@ -0,0 +1,261 @@
+"""Structured trace records and sampled raw upstream payloads, written off the request path.
+
+Records go onto a bounded queue and a background thread writes them as JSON
+lines, into gzip files under TRACE_DIR that rotate by size, or to stderr when
+no directory is configured. Nothing on the request path waits for stdout or
+disk; when the writer can't keep up, records are dropped and counted.
+
+Raw payloads (AMap and Wikipedia responses, LLM completions, answers) are
+only kept in TRACE_DIR, for a TRACE_SAMPLE_RATE share of the calls. Longer
+ones are cut to their first TRACE_MAX_PAYLOAD_BYTES of JSON and marked
+truncated. Fresh POI dumps in the `amap_*.json` format the local index loads
+can be exported from them:
+
+    python -m tracing export [--traces traces] [--out .]
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import orjson
+
+# never written to a trace
+SECRET_PARAMS = {"key", "api_key"}
+
+
+def serialize(value):
+    # pydantic models (LLM completions, responses) are only dumped on the writer thread
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "dict"):
+        return value.dict()
+    return str(value)
+
+
+class Tracer:
+    def __init__(self, directory=None, sample_rate=0.0, max_payload_bytes=256 * 1024, queue_size=10000,
+                 max_file_bytes=64 * 1024 * 1024, max_files=20, flush_interval=1.0):
+        self.directory = directory
+        self.sample_rate = sample_rate if directory else 0.0
+        self.max_payload_bytes = max_payload_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = None
+        self.file_bytes = 0
+        self.sequence = 0
+        self.written = 0
+        self.dropped = 0
+        self.captured = 0
+        self.truncated = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("TRACE_DIR") or None,
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0.0)),
+            max_payload_bytes=int(os.getenv("TRACE_MAX_PAYLOAD_BYTES", 256 * 1024)),
+            queue_size=int(os.getenv("TRACE_QUEUE_SIZE", 10000)),
+            max_file_bytes=int(os.getenv("TRACE_MAX_FILE_BYTES", 64 * 1024 * 1024)),
+            max_files=int(os.getenv("TRACE_MAX_FILES", 20)),
+        )
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                if self.directory:
+                    os.makedirs(self.directory, exist_ok=True)
+                self.thread = threading.Thread(target=self.run, name="tracer", daemon=True)
+                self.thread.start()
+
+    def put(self, record):
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def log(self, event, **fields):
+        """A structured log record, e.g. log("error", stage="amap.around", error=str(e))."""
+        self.put({"ts": time.time(), "event": event, **fields})
+
+    def capture(self, source, payload, **fields):
+        """Keep a raw payload, for a sampled share of the calls."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return
+        self.captured += 1
+        if "params" in fields:
+            fields["params"] = public_params(fields["params"])
+        self.put({"ts": time.time(), "event": "capture", "source": source, **fields, "payload": payload})
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+                continue
+            if record is None:
+                self.flush()
+                return
+            try:
+                self.write(record)
+            except Exception as e:
+                print(f"Error writing trace record: {str(e)}", file=sys.stderr)
+
+    def encode(self, record):
+        if record.get("event") != "capture":
+            return orjson.dumps(record, default=serialize) + b"\n"
+        fields = {name: value for name, value in record.items() if name != "payload"}
+        payload = orjson.dumps(record["payload"], default=serialize)
+        if len(payload) > self.max_payload_bytes:
+            # the first TRACE_MAX_PAYLOAD_BYTES of the JSON, as text, cut at a character boundary
+            self.truncated += 1
+            fields.update(truncated=True, bytes=len(payload))
+            payload = orjson.dumps(payload[:self.max_payload_bytes].decode("utf-8", errors="ignore"))
+        # the payload is encoded once and spliced in
+        return orjson.dumps(fields, default=serialize)[:-1] + b',"payload":' + payload + b"}\n"
+
+    def write(self, record):
+        line = self.encode(record)
+        if not self.directory:
+            sys.stderr.buffer.write(line)
+            sys.stderr.flush()
+            self.written += 1
+            return
+        if self.file is None or self.file_bytes + len(line) > self.max_file_bytes:
+            self.rotate()
+        self.file.write(line)
+        self.file_bytes += len(line)
+        self.written += 1
+
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.sequence += 1
+        name = f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.sequence}.jsonl.gz"
+        self.file = gzip.open(os.path.join(self.directory, name), "ab")
+        self.file_bytes = 0
+        # this process's oldest files go first
+        files = sorted(glob.glob(os.path.join(self.directory, f"trace-*-{os.getpid()}-*.jsonl.gz")), key=os.path.getmtime)
+        for path in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        """Write out what is queued, e.g. on shutdown."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+        self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "captured": self.captured,
+            "truncated": self.truncated,
+        }
+
+
+# configured on first use, so settings from .env are already loaded
+tracer = None
+
+
+def get_tracer():
+    global tracer
+    if tracer is None:
+        tracer = Tracer.from_env()
+    return tracer
+
+
+def log(event, **fields):
+    get_tracer().log(event, **fields)
+
+
+def capture(source, payload, **fields):
+    get_tracer().capture(source, payload, **fields)
+
+
+def close():
+    if tracer is not None:
+        tracer.close()
+
+
+def public_params(params):
+    return {name: value for name, value in (params or {}).items() if name not in SECRET_PARAMS}
+
+
+def read_records(directory):
+    """Every record in the trace files of a directory, oldest file first."""
+    for path in sorted(glob.glob(os.path.join(directory, "trace-*.jsonl.gz")), key=os.path.getmtime):
+        try:
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    yield orjson.loads(line)
+        except (OSError, EOFError, orjson.JSONDecodeError) as e:
+            # the file being written by a running server ends mid-record
+            print(f"Stopped reading {path}: {str(e)}", file=sys.stderr)
+
+
+def export_amap_dumps(directory, out="."):
+    """Merge the captured AMap nearby searches into one amap_<city>.json per city."""
+    cities = {}
+    for record in read_records(directory):
+        if record.get("event") != "capture" or record.get("source") != "amap" or not record.get("payload"):
+            continue
+        # a truncated payload is only the start of the JSON
+        if record.get("truncated"):
+            continue
+        if record.get("path") != "/v3/place/around":
+            continue
+        for poi in record["payload"].get("pois") or []:
+            if poi.get("id") and poi.get("location"):
+                cities.setdefault(poi.get("cityname") or "unknown", {})[poi["id"]] = poi
+
+    paths = []
+    for city, pois in cities.items():
+        path = os.path.join(out, f"amap_{city}.json")
+        data = {"status": "1", "info": "OK", "count": str(len(pois)), "pois": list(pois.values())}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        paths.append((path, len(pois)))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="write amap_*.json dumps from the captured AMap payloads")
+    export.add_argument("--traces", default=os.getenv("TRACE_DIR") or "traces")
+    export.add_argument("--out", default=".")
+    args = parser.parse_args()
+
+    for path, count in export_amap_dumps(args.traces, args.out):
+        print(f"{path}: {count} POIs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+
+from metrics import span
+from tokens import estimate_tokens, truncate_tokens
+
+WIKIPEDIA_API = "/w/api.php"
+
+HEADING = re.compile(r"^(={2,})\s*(.+?)\s*\1\s*$")
+WORD = re.compile(r"[a-z0-9]+|[㐀-䶿一-鿿]+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "and", "or", "is", "are",
+    "was", "were", "me", "tell", "about", "what", "who", "how", "this", "that", "it",
+}
+
+
+def tokenize(text):
+    """Lowercased words; CJK runs become character unigrams and bigrams."""
+    tokens = []
+    for word in WORD.findall(text.lower()):
+        if word[0] >= "㐀":
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word not in STOPWORDS:
+            tokens.append(word)
+    return tokens
+
+
+def chunk_article(title, text, max_tokens=200):
+    """Split a plaintext extract into passages that stay inside one section."""
+    sections = [(title, [])]
+    for line in text.splitlines():
+        heading = HEADING.match(line.strip())
+        if heading:
+            sections.append((heading.group(2), []))
+        elif line.strip():
+            sections[-1][1].append(line.strip())
+
+    chunks = []
+    for section, paragraphs in sections:
+        current, size = [], 0
+        for paragraph in paragraphs:
+            paragraph = truncate_tokens(paragraph, max_tokens)
+            tokens = estimate_tokens(paragraph)
+            if current and size + tokens > max_tokens:
+                chunks.append({"section": section, "text": "\n".join(current)})
+                current, size = [], 0
+            current.append(paragraph)
+            size += tokens
+        if current:
+            chunks.append({"section": section, "text": "\n".join(current)})
+    return chunks
+
+
+class BM25:
+    """Okapi BM25 over the passages of one article."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(doc)) for doc in documents]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.docs) if self.docs else 0
+        df = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query):
+        terms = set(tokenize(query))
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+class DiskCache:
+    """JSON files in a directory, evicting the least recently used beyond a limit."""
+
+    def __init__(self, directory, max_entries=500, ttl=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+            # bump the access time so eviction is least recently *used*
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except (OSError, ValueError):
+            # also when another worker evicted the entry right after it was read
+            return None
+        return value
+
+    def put(self, key, value):
+        path = self.path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_atime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class WikipediaContext:
+    """Relevant Wikipedia passages for a prompt, instead of whole articles.
+
+    Search results and article extracts are cached on disk. Each article is
+    split into passages and indexed with BM25 once, and only the passages that
+    best match the visitor's query are returned, within a token budget.
+    """
+
+    def __init__(self, http, cache, max_tokens=800, top_k=4, chunk_tokens=200, max_indexes=256):
+        self.http = http
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.chunk_tokens = chunk_tokens
+        self.max_indexes = max_indexes
+        self.indexes = OrderedDict()
+
+    @classmethod
+    def from_env(cls, http):
+        cache = DiskCache(
+            os.getenv("WIKI_CACHE_DIR") or "wiki_cache",
+            max_entries=int(os.getenv("WIKI_CACHE_MAX_ENTRIES", 500)),
+            ttl=int(os.getenv("WIKI_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+        )
+        return cls(
+            http,
+            cache,
+            max_tokens=int(os.getenv("WIKI_CONTEXT_TOKENS", 800)),
+            top_k=int(os.getenv("WIKI_CONTEXT_TOP_K", 4)),
+            chunk_tokens=int(os.getenv("WIKI_CHUNK_TOKENS", 200)),
+        )
+
+    async def search(self, query):
+        """Title and pageid of the first search hit, or None."""
+        key = "search:" + " ".join(query.lower().split())
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached.get("hit")
+
+        search_params = {
+            "action": "query",
+            "list": "search",
+            "srsearch": query,
+            "format": "json",
+        }
+        with span("wikipedia.search"):
+            search_data = await self.http.get_json(WIKIPEDIA_API, search_params)
+        hit = None
+        if search_data.get("query") and search_data["query"].get("search"):
+            first_result = search_data["query"]["search"][0]
+            hit = {"pageid": first_result["pageid"], "title": first_result["title"]}
+        await asyncio.to_thread(self.cache.put, key, {"hit": hit})
+        return hit
+
+    async def article(self, pageid):
+        """Plaintext extract of a page."""
+        key = f"article:{pageid}"
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached["extract"]
+
+        article_params = {
+            "action": "query",
+            "prop": "extracts",
+            "pageids": pageid,
+            "explaintext": True,  # Returns plain text; remove for HTML content
+            "format": "json",
+        }
+        with span("wikipedia.extract"):
+            article_data = await self.http.get_json(WIKIPEDIA_API, article_params)
+        extract = article_data["query"]["pages"][str(pageid)].get("extract", "")
+        await asyncio.to_thread(self.cache.put, key, {"extract": extract})
+        return extract
+
+    async def index(self, hit):
+        pageid = hit["pageid"]
+        if pageid in self.indexes:
+            self.indexes.move_to_end(pageid)
+            return self.indexes[pageid]
+        extract = await self.article(pageid)
+        chunks = chunk_article(hit["title"], extract, self.chunk_tokens)
+        index = (chunks, BM25([chunk["section"] + " " + chunk["text"] for chunk in chunks]))
+        self.indexes[pageid] = index
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return index
+
+    def select(self, chunks, scores, max_tokens):
+        # the lead section is a good summary even when nothing matches
+        ranked = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+        picked, used = [], 0
+        for i in ranked:
+            if len(picked) == self.top_k:
+                break
+            tokens = estimate_tokens(chunks[i]["text"])
+            if used + tokens > max_tokens:
+                continue
+            picked.append(i)
+            used += tokens
+        # keep article order so passages read naturally
+        return [chunks[i] for i in sorted(picked)]
+
+    async def context(self, search, query=None, max_tokens=None):
+        """Passages of the best article for `search`, ranked against `query`."""
+        hit = await self.search(search)
+        if hit is None:
+            return ""
+        chunks, bm25 = await self.index(hit)
+        if not chunks:
+            return ""
+        passages = self.select(chunks, bm25.scores(query or search), max_tokens or self.max_tokens)
+        return "\n\n".join(f"[{hit['title']} - {chunk['section']}]\n{chunk['text']}" for chunk in passages)
@@ -1,4 +1,5 @@
 import { useState, useCallback, useRef } from 'react';
+import { prefetchArea } from '../utils/api';
 
 /**
  * Custom hook for handling map location updates
@@ -25,7 +26,9 @@ const useLocation = () => {
             setLat(center.lat());
             setLng(center.lng());
             setLocation(response.results[0].formatted_address);
-        
+            // warm the backend for this spot while the visitor is still speaking
+            prefetchArea(response.results[0].formatted_address, center.lat(), center.lng());
+
           } else {
             setLocation('Location not found');
           }
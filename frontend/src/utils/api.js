@@ -1,3 +1,8 @@
+// One conversation per page load; the backend keys its session store on this id
+const SESSION_ID = (window.crypto && window.crypto.randomUUID)
+  ? window.crypto.randomUUID()
+  : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 /**
  * Makes a request to the Voice View backend API
  * @param {string} query - The query or prompt to send
@@ -18,7 +23,7 @@ export const fetchGuideResponse = async (query, locationName, latitude, longitud
   };
   
   try {
-    const response = await fetch(`https://voice-view-backend-ef6f06a14ec9.herokuapp.com/answer?query=${encodeURIComponent(query)}`, {
+    const response = await fetch(`https://voice-view-backend-ef6f06a14ec9.herokuapp.com/answer?query=${encodeURIComponent(query)}&session_id=${SESSION_ID}`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -35,4 +40,79 @@ export const fetchGuideResponse = async (query, locationName, latitude, longitud
     console.error('Error fetching from backend:', error);
     throw error;
   }
-}; 
\ No newline at end of file
+}; 
+
+/**
+ * Asks the backend to warm the landmarks and context around a map position,
+ * so an answer for it only has to wait for the LLM. Best effort: errors and
+ * rate limiting (HTTP 429) are ignored.
+ * @param {string} locationName - address of the current map location
+ * @param {number} latitude - Latitude coordinate
+ * @param {number} longitude - Longitude coordinate
+ */
+export const prefetchArea = (locationName, latitude, longitude) => {
+  fetch(`https://voice-view-backend-ef6f06a14ec9.herokuapp.com/prefetch`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ name: locationName, latitude, longitude })
+  }).catch(() => {});
+};
+
+/**
+ * Streaming variant of fetchGuideResponse, backed by the /answer/stream SSE endpoint
+ * @param {string} query - The query or prompt to send
+ * @param {string} locationName - address of the current map location
+ * @param {number} latitude - Latitude coordinate
+ * @param {number} longitude - Longitude coordinate
+ * @param {boolean} isFirstRequest - Whether this is the first request in the session
+ * @param {Object} handlers - onSpeech(textChunk) and onLocation(location), called as events arrive
+ * @returns {Promise<Object>} - Promise resolving to the complete API response
+ */
+export const streamGuideResponse = async (query, locationName, latitude, longitude, isFirstRequest = false, handlers = {}) => {
+  const payload = {
+    city: {
+      name: locationName,
+      latitude,
+      longitude
+    },
+    is_first_request: isFirstRequest
+  };
+
+  const response = await fetch(`https://voice-view-backend-ef6f06a14ec9.herokuapp.com/answer/stream?query=${encodeURIComponent(query)}&session_id=${SESSION_ID}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(payload)
+  });
+
+  if (!response.ok) {
+    throw new Error(`API call failed: ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || 'null');
+
+      if (event === 'speech' && handlers.onSpeech) handlers.onSpeech(data.text);
+      if (event === 'location' && handlers.onLocation) handlers.onLocation(data);
+      if (event === 'error') throw new Error(data.detail);
+      if (event === 'done') return data;
+    }
+  }
+  throw new Error('Stream ended before the response was complete');
+};